@@ -8,6 +8,7 @@ missing, or descriptive (summary-like) lyric content.
 Outputs: lyrics_integrity_report.csv
 """
 
+import importlib.util
 import pandas as pd
 import numpy as np
 import re
@@ -15,6 +16,9 @@ import re
 INPUT_FILE = "master_ready_to_score.csv"
 OUTPUT_FILE = "lyrics_integrity_report.csv"
 
+# Only these columns are read: enough to identify a track in the report
+REPORT_COLS = ["Title", "Artist", "Track ID", "Source Link", "Lyrics"]
+
 # Keywords that often indicate descriptive or non-lyric text
 SUMMARY_KEYWORDS = [
     "originally written", "composed", "published", "recorded",
@@ -23,44 +27,53 @@ SUMMARY_KEYWORDS = [
     "music was", "believed to be", "released in", "instrumental",
 ]
 
-# Phrases that indicate missing or short content
-MISSING_PATTERN = re.compile(r"^\s*$")
+# Column-wide patterns (matched against lowercased lyrics)
+INSTR_RE = re.compile(r"\b(?:instrumental|no lyrics|piano|sonata|etude|nocturne|symphony)\b")
+SUMMARY_RE = re.compile("|".join(re.escape(k) for k in SUMMARY_KEYWORDS))
+
 
-def flag_lyrics_quality(lyrics):
-    """Return category: GOOD / SHORT / SUMMARY / MISSING / INSTRUMENTAL"""
-    if pd.isna(lyrics):
-        return "MISSING"
+def contains_summary(lower):
+    """True where a lowercased lyric contains any SUMMARY_KEYWORDS phrase."""
+    return lower.str.contains(SUMMARY_RE, regex=True)
 
-    text = str(lyrics).strip()
-    word_count = len(text.split())
 
-    # Missing or empty
-    if word_count == 0 or MISSING_PATTERN.match(text):
-        return "MISSING"
+def flag_lyrics_series(lyrics):
+    """
+    Category for each lyric in a Lyrics column: MISSING / INSTRUMENTAL / SHORT / SUMMARY / GOOD
+    (checked in that order, first match wins).
+    """
+    # one lowered copy shared by every test (split() ignores edge whitespace, so no strip pass)
+    lower = lyrics.fillna("").astype(str).str.lower()
+    word_count = lower.str.split().str.len()
 
-    # Instrumental or classical tags
-    if re.search(r"\b(instrumental|no lyrics|piano|sonata|etude|nocturne|symphony)\b", text.lower()):
-        return "INSTRUMENTAL"
+    is_missing = lyrics.isna() | (word_count == 0)
+    is_instr = lower.str.contains(INSTR_RE, regex=True)
+    is_short = word_count < 25
+    is_summary = contains_summary(lower)
 
-    # Very short (e.g., 1-2 sentences only)
-    if word_count < 25:
-        return "SHORT"
+    status = np.select(
+        [is_missing, is_instr, is_short, is_summary],
+        ["MISSING", "INSTRUMENTAL", "SHORT", "SUMMARY"],
+        default="GOOD",
+    )
+    return pd.Series(status, index=lyrics.index)
 
-    # Contains summary phrases (not actual lyrics)
-    if any(k in text.lower() for k in SUMMARY_KEYWORDS):
-        return "SUMMARY"
 
-    # Otherwise fine
-    return "GOOD"
+def read_input(path):
+    """Read just REPORT_COLS; Arrow's multithreaded parser when pyarrow is installed."""
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in REPORT_COLS if c in header]
+    engine = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+    return pd.read_csv(path, usecols=usecols, dtype={"Lyrics": "string"}, engine=engine)
 
 
 def main():
-    df = pd.read_csv(INPUT_FILE)
+    df = read_input(INPUT_FILE)
     if "Lyrics" not in df.columns:
         raise ValueError("CSV missing 'Lyrics' column")
 
     # Apply checker
-    df["Lyrics_status"] = df["Lyrics"].apply(flag_lyrics_quality)
+    df["Lyrics_status"] = flag_lyrics_series(df["Lyrics"])
 
     # Aggregate stats
     counts = df["Lyrics_status"].value_counts().to_dict()
@@ -7,27 +7,42 @@ INFILE = "step2_lyrics_output.csv"
 OUT_READY = "master_ready_to_score.csv"
 OUT_NEEDS = "master_needs_fill.csv"
 
-
-def fix_mojibake(s: str):
-    """Repair typical UTF-8→Latin-1 mojibake only when detected."""
-    if not isinstance(s, str) or s == "":
-        return s
-    # common telltales: Ã, Â, â€™, â€œ, â€, etc.
-    if any(mark in s for mark in ("Ã", "Â", "â€™", "â€œ", "â€\x9d", "â€“", "â€”")):
-        try:
-            return s.encode("latin1", errors="ignore").decode("utf-8", errors="ignore")
-        except Exception:
-            return s
-    return s
-
-
-
-def clean_lyrics(s: str):
-    if not isinstance(s, str): return s
-    s = re.sub(r"(?is)\b\d+\s+Contributors.*?$", "", s)
-    s = re.sub(r"(?is)Read More.*?$", "", s)
-    s = re.sub(r"(?is)Page \d+(?:\s+Page \d+)*", "", s)
-    return s.strip()
+# Also hand the ready set to the scorer as Parquet (typed, columnar, much faster
+# to write/read than CSV). Needs pyarrow; the CSV is still written for people.
+WRITE_PARQUET = False
+OUT_READY_PARQUET = "master_ready_to_score.parquet"
+
+
+# common telltales: Ã, Â, â€™, â€œ, â€, etc.
+MOJIBAKE_RE = re.compile("|".join(re.escape(m) for m in ("Ã", "Â", "â€™", "â€œ", "â€\x9d", "â€“", "â€”")))
+
+def fix_mojibake(col: pd.Series):
+    """Repair typical UTF-8→Latin-1 mojibake only on the cells where it is detected."""
+    if col.dtype != object and not isinstance(col.dtype, pd.StringDtype):
+        return col  # no strings in this column (e.g. all NaN)
+    mask = col.str.contains(MOJIBAKE_RE, regex=True, na=False).astype(bool)
+    if not mask.any():
+        return col
+    col = col.copy()
+    col.loc[mask] = (col.loc[mask]
+                     .str.encode("latin1", errors="ignore")
+                     .str.decode("utf-8", errors="ignore"))
+    return col
+
+
+
+_CONTRIB_RE  = re.compile(r"\b\d+\s+Contributors.*?$", re.I | re.S)
+_READMORE_RE = re.compile(r"Read More.*?$", re.I | re.S)
+_PAGE_RE     = re.compile(r"Page \d+(?:\s+Page \d+)*", re.I | re.S)
+
+def clean_lyrics(col: pd.Series):
+    """Strip Genius page furniture (contributors, Read More, page markers) from a Lyrics column."""
+    if col.dtype != object and not isinstance(col.dtype, pd.StringDtype):
+        return col
+    return (col.str.replace(_CONTRIB_RE, "", regex=True)
+               .str.replace(_READMORE_RE, "", regex=True)
+               .str.replace(_PAGE_RE, "", regex=True)
+               .str.strip())
 
 df = pd.read_csv(INFILE)
 
@@ -40,15 +55,10 @@ for c in must_cols:
     if c not in df.columns:
         df[c] = None
 
-# AFTER reading the CSV and after you fill *_new, normalize Title/Artist once:
-for col in ["Title", "Artist"]:
-    if col in df.columns:
-        df[col] = df[col].apply(fix_mojibake)
-
 # Fix mojibake (also pick *_new if present)
 for col in ["Title","Artist","Title_new","Artist_new"]:
     if col in df.columns:
-        df[col] = df[col].apply(fix_mojibake)
+        df[col] = fix_mojibake(df[col])
 
 if "Title_new" in df.columns:
     df["Title"] = df["Title_new"].where(df["Title_new"].notna() & (df["Title_new"].str.strip()!=""), df["Title"])
@@ -56,7 +66,7 @@ if "Artist_new" in df.columns:
     df["Artist"] = df["Artist_new"].where(df["Artist_new"].notna() & (df["Artist_new"].str.strip()!=""), df["Artist"])
 
 # Clean lyrics and coerce numerics
-df["Lyrics"] = df["Lyrics"].apply(clean_lyrics)
+df["Lyrics"] = clean_lyrics(df["Lyrics"])
 for numcol in ["BPM","Lyric sentiment valence","Lyric sentiment arousal"]:
     df[numcol] = pd.to_numeric(df[numcol], errors="coerce")
     if numcol != "BPM":
@@ -75,15 +85,12 @@ df["required_ok"] = (
     df["Lyric sentiment valence"].notna()
 )
 
-def missing_list(row):
-    miss = []
-    for c in ["Track ID","Source Link","BPM","Mode","Lyric sentiment valence"]:
-        v = row.get(c)
-        if pd.isna(v) or (isinstance(v, str) and not v.strip()):
-            miss.append(c)
-    return ", ".join(miss)
-
-df["missing"] = df.apply(missing_list, axis=1)
+# Comma-joined list of missing required columns (bool matrix · names)
+req_cols = ["Track ID","Source Link","BPM","Mode","Lyric sentiment valence"]
+miss = pd.DataFrame({
+    c: df[c].isna() | (df[c].astype(str).str.strip() == "") for c in req_cols
+})
+df["missing"] = miss.dot(pd.Series([c + ", " for c in req_cols], index=req_cols)).str.rstrip(", ")
 df["ready_to_score"] = df["required_ok"].map({True:"READY", False:"HOLD"})
 
 # Stamp date if empty
@@ -95,6 +102,9 @@ ready = df[df["required_ok"]].copy()
 needs = df[~df["required_ok"]].copy()
 ready.to_csv(OUT_READY, index=False, encoding="utf-8-sig", quoting=csv.QUOTE_MINIMAL)
 needs.to_csv(OUT_NEEDS, index=False, encoding="utf-8-sig", quoting=csv.QUOTE_MINIMAL)
+if WRITE_PARQUET:
+    ready.to_parquet(OUT_READY_PARQUET, index=False)
+    print(f"📦 Wrote {OUT_READY_PARQUET}")
 
 
 print(f"✅ Wrote {OUT_READY} ({len(ready)} rows) and {OUT_NEEDS} ({len(needs)} rows))")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# pipeline_utils.py
+# Helpers shared by the step scripts: rate limiters, JSON encoding, CSV reading/cell values.
+
+import json, time, asyncio, threading, importlib.util
+import pandas as pd
+
+# ---------- Rate limiting ----------
+class RateLimiter:
+    """Thread-safe token bucket: `rate` calls per second on average, bursts up to `burst`."""
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Refill, then take a token (returns 0) or say how long until one is due."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._take()
+            if not delay:
+                return
+            time.sleep(delay)
+
+class AsyncRateLimiter(RateLimiter):
+    """RateLimiter for coroutines (same bucket); waits with asyncio.sleep instead of blocking."""
+    def __init__(self, rate, burst=1):
+        super().__init__(rate, burst)
+        self._lock = None  # made on first use, inside the running loop
+
+    async def wait(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        while True:
+            async with self._lock:
+                delay = self._take()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+# ---------- JSON ----------
+# orjson (when installed) for cache/lexicon/batch JSON; either way json_dumps() gives UTF-8 JSON bytes
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    def json_loads(v):
+        try:
+            return orjson.loads(v)
+        except orjson.JSONDecodeError:
+            return json.loads(v)  # rows from older runs may hold NaN, which orjson rejects
+except ImportError:
+    def json_dumps(v):
+        return json.dumps(v, ensure_ascii=False).encode("utf-8")
+    json_loads = json.loads
+
+# ---------- CSV ----------
+def read_csv_text(path):
+    """
+    Every column as text, exactly as written (blank cells as ""), so columns a step only
+    passes through come out unchanged. Uses Arrow's multithreaded parser when pyarrow is
+    installed; the C parser otherwise, or if Arrow rejects the file (it can't split quoted
+    values holding newlines).
+    """
+    if importlib.util.find_spec("pyarrow"):
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        header = pd.read_csv(path, nrows=0).columns
+        opts = pacsv.ConvertOptions(column_types={c: pa.string() for c in header},
+                                    strings_can_be_null=False, quoted_strings_can_be_null=False)
+        try:
+            return pacsv.read_csv(path, convert_options=opts).to_pandas()
+        except pa.ArrowInvalid:
+            pass
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def csv_value(v):
+    """Missing values (None/NaN/pd.NA) as empty cells, like DataFrame.to_csv."""
+    return "" if v is None or v is pd.NA or (isinstance(v, float) and v != v) else v
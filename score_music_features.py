@@ -7,11 +7,22 @@ computes feature-level scores, evidence-weighted total scores, and outputs
 scored_tracks_sorted.csv sorted from highest to lowest Total_score.
 """
 
+import os
+import importlib.util
 import pandas as pd
 import numpy as np
 
+_HAS_ARROW = importlib.util.find_spec("pyarrow") is not None  # read_parquet engine
+
+try:
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except Exception:
+    _HAS_NUMBA = False
+
 # ---------- Base Config ----------
 INPUT_FILE = "master_ready_to_score.csv"
+INPUT_PARQUET = "master_ready_to_score.parquet"  # written by clean_and_flag.py when WRITE_PARQUET is on
 OUTPUT_FILE = "scored_tracks_sorted.csv"
 
 BASE_WEIGHTS = {
@@ -47,37 +58,73 @@ LETTER_CUTOFFS = {
     "D": 60, "F": 0,
 }
 
-# ---------- Scoring helpers ----------
+FEATURES = ["BPM", "Mode", "Lyric sentiment valence", "Lyric sentiment arousal"]
+
+EVIDENCE_COLS = {
+    "BPM": "BPM_evidence",
+    "Mode": "Mode_evidence",
+    "Lyric sentiment valence": "LyricVal_evidence",
+    "Lyric sentiment arousal": "LyricAro_evidence",
+}
+
+# Pre-materialized lookup arrays (built once at import)
+_BASE_W = np.array([BASE_WEIGHTS[f] for f in FEATURES])
+_GRADES = sorted(LETTER_CUTOFFS.items(), key=lambda kv: kv[1])
+_GRADE_LABELS = np.array([g for g, _ in _GRADES], dtype=object)
+_GRADE_CUTOFFS = np.array([t for _, t in _GRADES], dtype=float)
+
+# ---------- Scoring helpers (column-wise) ----------
+MODE_SCORES = {"major": 1.0, "mixolydian": 0.8, "dorian": 0.5, "minor": 0.4}
+# below this many rows the NumPy expression wins: numba's JIT compile and thread start-up
+# cost more than the whole column takes (typical runs are hundreds to low thousands of rows)
+NUMBA_MIN_ROWS = 200_000
+
+
+if _HAS_NUMBA:
+    # no fastmath: it assumes no NaNs and would fold away the isnan check
+    @njit(parallel=True, cache=True)
+    def _range_decay_nb(x, ideal_min, ideal_max, hard_min, hard_max, out):
+        for i in prange(x.shape[0]):
+            v = x[i]
+            if np.isnan(v):
+                out[i] = np.nan
+            elif v < ideal_min:
+                out[i] = 0.0 if v <= hard_min else (v - hard_min) / (ideal_min - hard_min)
+            elif v <= ideal_max:
+                out[i] = 1.0
+            elif v < hard_max:
+                out[i] = 1 - (v - ideal_max) / (hard_max - ideal_max)
+            else:
+                out[i] = 0.0
+
+
 def range_decay(x, ideal_min, ideal_max, hard_min, hard_max):
-    if pd.isna(x):
-        return np.nan
-    if ideal_min <= x <= ideal_max:
-        return 1.0
-    if x < ideal_min:
-        if x <= hard_min:
-            return 0.0
-        return (x - hard_min) / (ideal_min - hard_min)
-    if x > ideal_max:
-        if x >= hard_max:
-            return 0.0
-        return 1 - (x - ideal_max) / (hard_max - ideal_max)
-    return 0.0
+    """1.0 inside [ideal_min, ideal_max], linear decay to 0 at the hard limits, NaN stays NaN."""
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    if _HAS_NUMBA and x.shape[0] >= NUMBA_MIN_ROWS:
+        # one fused pass, no temporaries
+        out = np.empty_like(x)
+        _range_decay_nb(x, float(ideal_min), float(ideal_max), float(hard_min), float(hard_max), out)
+        return out
+    out = np.select(
+        [x < ideal_min, x <= ideal_max, x < hard_max],
+        [np.clip((x - hard_min) / (ideal_min - hard_min), 0.0, 1.0),
+         1.0,
+         1 - (x - ideal_max) / (hard_max - ideal_max)],
+        default=0.0,
+    )
+    return np.where(np.isnan(x), np.nan, out)
 
 
 def score_bpm(bpm):
     s1 = range_decay(bpm, 60, 80, 50, 130)
     s2 = range_decay(bpm, 100, 120, 50, 130)
-    if np.isnan(s1) and np.isnan(s2):
-        return np.nan
-    return max(s1, s2)
+    return np.maximum(s1, s2)  # NaN only where BPM is NaN
 
 
 def score_mode(mode):
-    if pd.isna(mode):
-        return np.nan
-    m = str(mode).strip().lower()
-    mapping = {"major": 1.0, "mixolydian": 0.8, "dorian": 0.5, "minor": 0.4}
-    return mapping.get(m, 0.3)
+    m = mode.astype(str).str.strip().str.lower().map(MODE_SCORES).fillna(0.3)
+    return m.where(mode.notna()).to_numpy(dtype=float)
 
 
 def score_valence(v):
@@ -88,100 +135,92 @@ def score_arousal(a):
     return range_decay(a, 0.2, 0.6, -0.3, 1.0)
 
 
-def evidence_mult(label):
-    if pd.isna(label):
-        return 1.0
-    key = str(label).lower().strip()
-    return EVIDENCE_MULTIPLIERS.get(key, 1.0)
-
-
-def letter_grade(score):
-    if pd.isna(score):
-        return "N/A"
-    pct = 100 * score
-    for g, t in sorted(LETTER_CUTOFFS.items(), key=lambda kv: -kv[1]):
-        if pct >= t:
-            return g
-    return "F"
-
-
-# ---------- Row scoring ----------
-def score_row(row):
-    feats = ["BPM", "Mode", "Lyric sentiment valence", "Lyric sentiment arousal"]
-    evidence_cols = {
-        "BPM": "BPM_evidence",
-        "Mode": "Mode_evidence",
-        "Lyric sentiment valence": "LyricVal_evidence",
-        "Lyric sentiment arousal": "LyricAro_evidence",
+def evidence_mult(labels):
+    key = labels.astype(str).str.lower().str.strip()
+    return key.map(EVIDENCE_MULTIPLIERS).fillna(1.0).to_numpy(dtype=float)
+
+
+def letter_grade(total):
+    """Letter grade for a Total_score column; scores below the lowest cutoff get F, NaN gets N/A."""
+    pct = 100 * np.asarray(total, dtype=float)
+    idx = np.searchsorted(_GRADE_CUTOFFS, pct, side="right") - 1
+    grades = _GRADE_LABELS[np.clip(idx, 0, None)]
+    return pd.Series(np.where(np.isnan(pct), "N/A", grades), index=total.index)
+
+
+# ---------- Frame scoring ----------
+def _numeric(df, col):
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def score_frame(df):
+    """Feature scores, normalized evidence weights and Total_score for every row, as column arrays."""
+    # Compute feature scores (N × 4)
+    mode = df["Mode"] if "Mode" in df.columns else pd.Series(np.nan, index=df.index)
+    scores = np.column_stack([
+        score_bpm(_numeric(df, "BPM")),
+        score_mode(mode),
+        score_valence(_numeric(df, "Lyric sentiment valence")),
+        score_arousal(_numeric(df, "Lyric sentiment arousal")),
+    ])
+
+    # Effective weights (base × evidence multiplier), normalized to sum = 1
+    weights = _BASE_W * np.column_stack([evidence_mult(df[EVIDENCE_COLS[f]]) for f in FEATURES])
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    # Weighted score over the features that are present
+    valid = ~np.isnan(scores)
+    numer = np.where(valid, scores * weights, 0.0).sum(axis=1)
+    denom = np.where(valid, weights, 0.0).sum(axis=1)
+    total = np.divide(numer, denom, out=np.full(len(df), np.nan), where=denom > 0)
+
+    return {
+        "BPM_score": scores[:, 0],
+        "Mode_score": scores[:, 1],
+        "LyricVal_score": scores[:, 2],
+        "LyricAro_score": scores[:, 3],
+        "BPM_weight": weights[:, 0],
+        "Mode_weight": weights[:, 1],
+        "LyricVal_weight": weights[:, 2],
+        "LyricAro_weight": weights[:, 3],
+        "Total_score": total,
     }
 
-    # Compute feature scores
-    feature_scores = {
-        "BPM": score_bpm(row.get("BPM", np.nan)),
-        "Mode": score_mode(row.get("Mode", np.nan)),
-        "Lyric sentiment valence": score_valence(row.get("Lyric sentiment valence", np.nan)),
-        "Lyric sentiment arousal": score_arousal(row.get("Lyric sentiment arousal", np.nan)),
-    }
 
-    # Effective weights (base × evidence multiplier)
-    eff_w = {}
-    for f in feats:
-        label = row.get(evidence_cols[f], np.nan)
-        mult = evidence_mult(label)
-        eff_w[f] = BASE_WEIGHTS[f] * mult
-
-    # Normalize weights to sum = 1
-    total_w = sum(eff_w.values())
-    eff_w = {k: v / total_w for k, v in eff_w.items()}
-
-    # Weighted score
-    numer = sum(feature_scores[f] * eff_w[f] for f in feats if not np.isnan(feature_scores[f]))
-    denom = sum(eff_w[f] for f in feats if not np.isnan(feature_scores[f]))
-    total = numer / denom if denom else np.nan
-    return feature_scores, eff_w, total
+# ---------- I/O ----------
+def load_input():
+    """Prefer the Parquet handoff when it is at least as new as the CSV (dtypes survive, no re-parse)."""
+    if (_HAS_ARROW and os.path.exists(INPUT_PARQUET)
+            and (not os.path.exists(INPUT_FILE)
+                 or os.path.getmtime(INPUT_PARQUET) >= os.path.getmtime(INPUT_FILE))):
+        return pd.read_parquet(INPUT_PARQUET)
+    return pd.read_csv(INPUT_FILE)
 
 
 # ---------- Main ----------
 def main():
-    df = pd.read_csv(INPUT_FILE)
+    df = load_input()
 
     # Ensure evidence columns exist and fill with defaults if missing
     for f, default in DEFAULT_EVIDENCE.items():
-        colname = {
-            "BPM": "BPM_evidence",
-            "Mode": "Mode_evidence",
-            "Lyric sentiment valence": "LyricVal_evidence",
-            "Lyric sentiment arousal": "LyricAro_evidence",
-        }[f]
+        colname = EVIDENCE_COLS[f]
         if colname not in df.columns:
             df[colname] = default
         else:
             df[colname] = df[colname].fillna(default)
             df.loc[df[colname].astype(str).str.strip() == "", colname] = default
 
-    results = []
-    for _, r in df.iterrows():
-        scores, wts, total = score_row(r)
-        out = {
-            **r.to_dict(),
-            "BPM_score": scores["BPM"],
-            "Mode_score": scores["Mode"],
-            "LyricVal_score": scores["Lyric sentiment valence"],
-            "LyricAro_score": scores["Lyric sentiment arousal"],
-            "BPM_weight": wts["BPM"],
-            "Mode_weight": wts["Mode"],
-            "LyricVal_weight": wts["Lyric sentiment valence"],
-            "LyricAro_weight": wts["Lyric sentiment arousal"],
-            "Total_score": total,
-            "Letter_grade": letter_grade(total),
-        }
-        results.append(out)
-
-    out_df = pd.DataFrame(results)
-    out_df.sort_values(by="Total_score", ascending=False, inplace=True)
-    out_df.reset_index(drop=True, inplace=True)
-    out_df.to_csv(OUTPUT_FILE, index=False)
-    print(f"✅ Done! {len(out_df)} tracks scored & sorted -> {OUTPUT_FILE}")
+    # Assign score columns in place (re-running on a scored file overwrites them)
+    for col, values in score_frame(df).items():
+        df[col] = values
+    df["Letter_grade"] = letter_grade(df["Total_score"])
+
+    df.sort_values(by="Total_score", ascending=False, inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    df.to_csv(OUTPUT_FILE, index=False)
+    print(f"✅ Done! {len(df)} tracks scored & sorted -> {OUTPUT_FILE}")
 
 
 if __name__ == "__main__":
@@ -2,10 +2,15 @@
 # step1_enrich.py
 # Fills BPM and Mode using Deezer, AcousticBrainz, GetSongBPM, and iTunes+local analysis.
 
-import os, io, re, json, time, math, requests, traceback, tempfile
+import os, io, re, csv, json, requests, traceback, tempfile, threading, sqlite3, functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import importlib
 from dotenv import load_dotenv
+from pipeline_utils import RateLimiter, csv_value
 
 # ---------- Missing-value helper ----------
 def is_missing(x):
@@ -27,11 +32,16 @@ USE_PYACA  = False
 
 RNNBeatProcessor = None
 TempoEstimationProcessor = None
+BeatTrackingProcessor = None
+Signal = None
+linregress = None
+stft = None
 computeKey = None
 np = None
 sf = None
 librosa = None
 AudioSegment = None
+av = None
 
 # madmom (tempo)
 try:
@@ -39,10 +49,19 @@ try:
     tempo_mod = importlib.import_module("madmom.features.tempo")     # type: ignore
     RNNBeatProcessor = getattr(beats_mod, "RNNBeatProcessor")
     TempoEstimationProcessor = getattr(tempo_mod, "TempoEstimationProcessor")
+    Signal = importlib.import_module("madmom.audio.signal").Signal  # type: ignore
+    BeatTrackingProcessor = getattr(beats_mod, "BeatTrackingProcessor", None)
     USE_MADMOM = True
 except Exception:
     pass
 
+# scipy (beat-time regression to refine madmom's tempo; STFT chroma for mode)
+try:
+    linregress = importlib.import_module("scipy.stats").linregress  # type: ignore
+    stft = importlib.import_module("scipy.signal").stft              # type: ignore
+except Exception:
+    pass
+
 # pyACA (key→mode) + deps
 try:
     np = importlib.import_module("numpy")                            # type: ignore
@@ -55,6 +74,12 @@ try:
 except Exception:
     pass
 
+# PyAV (in-memory MP3 decode when libsndfile can't)
+try:
+    av = importlib.import_module("av")                               # type: ignore
+except Exception:
+    pass
+
 # Optional fallbacks
 try:
     librosa = importlib.import_module("librosa")                     # type: ignore
@@ -62,6 +87,31 @@ try:
 except Exception:
     pass
 
+# madmom RNN weights are loaded once; the RNN itself runs multi-threaded
+MADMOM_THREADS = 4
+MADMOM_SR = 44100  # the rate RNNBeatProcessor's models expect
+TEMPO_FIT_R2 = 0.99  # beat grid must be this straight to trust the regression tempo
+_RNN = _TEMPO = _BEATS = None
+_MADMOM_LOCK = threading.Lock()
+
+def _madmom_processors():
+    """
+    Build the madmom processors on first use and share them across threads,
+    so a run that never reaches local analysis doesn't pay for loading the weights.
+    """
+    global _RNN, _TEMPO, _BEATS, USE_MADMOM
+    if _RNN is None and USE_MADMOM:
+        with _MADMOM_LOCK:
+            if _RNN is None and USE_MADMOM:
+                try:
+                    _TEMPO = TempoEstimationProcessor(fps=100)
+                    if BeatTrackingProcessor and linregress:
+                        _BEATS = BeatTrackingProcessor(fps=100)
+                    _RNN = RNNBeatProcessor(num_threads=MADMOM_THREADS)  # set last: marks "ready"
+                except Exception:
+                    USE_MADMOM = False
+    return _RNN, _TEMPO, _BEATS
+
 # Force pydub to use your ffmpeg if available
 FFMPEG_PATH = r"C:\Users\ryanz\OneDrive\Desktop\ffmpeg\ffmpeg-8.0-essentials_build\ffmpeg-8.0-essentials_build\bin\ffmpeg.exe"
 try:
@@ -73,51 +123,144 @@ except Exception:
 # ---------- Config & env ----------
 load_dotenv()
 GETSONGBPM_API_KEY = os.getenv("GETSONGBPM_API_KEY", "").strip()
+# MusicBrainz asks every client to identify itself with a contact address
+CONTACT_EMAIL = os.getenv("CONTACT_EMAIL", "you@example.com").strip()
+USER_AGENT = f"MusicTherapyDataPipeline/1.0 (contact: {CONTACT_EMAIL})"
 
 INPUT_CSV  = "step1_spotify_output.csv"
 OUTPUT_CSV = "step1_enriched.csv"
-CACHE_JSON = "step1_enrich_cache.json"
-
-# polite default pacing
-SLEEP_SHORT = 0.20
+INPUT_DTYPES = {"Title": "string", "Artist": "string", "BPM": "Float64", "Mode": "string",
+                "BPM Source": "string", "Mode Source": "string",
+                "Source link": "string", "Source Link": "string"}
+CACHE_DB   = "step1_enrich_cache.db"
+CACHE_JSON = "step1_enrich_cache.json"  # legacy cache, imported into CACHE_DB once
+
+# rows enriched concurrently (the work is almost entirely network wait);
+# per-host caps below keep this from turning into a burst against any one API
+MAX_WORKERS = 16
+
+# polite pacing: requests/second per API host, shared by all worker threads
+HOST_RATE_LIMITS = {
+    "api.deezer.com": 10,          # Deezer: 50 requests / 5 s
+    "musicbrainz.org": 1,          # MusicBrainz: 1 request / s per IP
+    "itunes.apple.com": 20 / 60,   # iTunes Search: ~20 requests / minute
+}
+# max requests in flight per host (MusicBrainz wants one at a time)
+HOST_MAX_INFLIGHT = {
+    "api.deezer.com": 8,
+    "musicbrainz.org": 1,
+    "itunes.apple.com": 4,
+}
 
 # ---------- Utilities ----------
 def log(*args):
     print(*args, flush=True)
 
-def _sanitize_for_json(obj):
-    """Recursively replace NaN/Inf with None so JSON stays valid."""
-    if isinstance(obj, float):
-        if math.isnan(obj) or math.isinf(obj):
-            return None
-        return obj
-    if isinstance(obj, dict):
-        return {k: _sanitize_for_json(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_sanitize_for_json(v) for v in obj]
-    return obj
+# one requests.Session per worker thread (Sessions are not thread-safe);
+# keep-alive reuses TCP/TLS connections and Retry handles 429/5xx backoff
+_tls = threading.local()
+
+def make_session():
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+    s = requests.Session()
+    s.headers["User-Agent"] = USER_AGENT
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)  # some preview CDNs hand out plain-http urls
+    return s
+
+def get_session():
+    s = getattr(_tls, "session", None)
+    if s is None:
+        s = _tls.session = make_session()
+    return s
+
+_LIMITERS = {host: RateLimiter(rate, burst=max(1, int(rate))) for host, rate in HOST_RATE_LIMITS.items()}
+_INFLIGHT = {host: threading.BoundedSemaphore(n) for host, n in HOST_MAX_INFLIGHT.items()}
+
+def http_get(url, **kwargs):
+    """GET through this thread's session, honoring the host's in-flight cap and token bucket."""
+    host = urlparse(url).hostname
+    slot = _INFLIGHT.get(host)
+    limiter = _LIMITERS.get(host)
+    if slot:
+        slot.acquire()
+    try:
+        if limiter:
+            limiter.wait()
+        return get_session().get(url, **kwargs)
+    finally:
+        if slot:
+            slot.release()
+
+# guards the shared BPM/Mode cache dict across worker threads
+_CACHE_LOCK = threading.Lock()
+_db = None
+
+def _cache_db():
+    global _db
+    if _db is None:
+        # WAL + synchronous=NORMAL makes the per-row commit in cache_put cheap;
+        # the connection is shared by the worker threads, serialized by _CACHE_LOCK.
+        _db = sqlite3.connect(CACHE_DB, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("PRAGMA synchronous=NORMAL")
+        _db.execute("CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, bpm REAL, mode TEXT)")
+    return _db
+
+def _import_json_cache(db):
+    """One-time migration of the old step1_enrich_cache.json into SQLite."""
+    if not os.path.exists(CACHE_JSON):
+        return
+    try:
+        with open(CACHE_JSON, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return
+    # SQLite stores NaN as NULL, so the old NaN/Inf scrub is not needed here
+    db.executemany(
+        "INSERT OR REPLACE INTO cache(key, bpm, mode) VALUES (?, ?, ?)",
+        [(k, (v or {}).get("BPM"), (v or {}).get("Mode")) for k, v in data.items()],
+    )
+    db.commit()
 
 def load_cache():
-    if os.path.exists(CACHE_JSON):
-        try:
-            with open(CACHE_JSON, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            return _sanitize_for_json(data)
-        except Exception:
-            pass
-    return {}
-
-def save_cache(cache):
-    tmp = CACHE_JSON + ".tmp"
-    safe = _sanitize_for_json(cache)
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(safe, f, ensure_ascii=False, indent=2, allow_nan=False)
-    os.replace(tmp, CACHE_JSON)
+    """Read the whole table into the in-memory dict that cache_get/cache_put keep in sync."""
+    db = _cache_db()
+    if db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 0:
+        _import_json_cache(db)
+    return {k: {"BPM": bpm, "Mode": mode}
+            for k, bpm, mode in db.execute("SELECT key, bpm, mode FROM cache")}
+
+def cache_get(cache, key):
+    with _CACHE_LOCK:
+        return cache.get(key)
+
+def cache_put(cache, key, bpm, mode):
+    """Write-through: update the dict and upsert + commit the one row."""
+    with _CACHE_LOCK:
+        cache[key] = {"BPM": bpm, "Mode": mode}
+        db = _cache_db()
+        db.execute("INSERT OR REPLACE INTO cache(key, bpm, mode) VALUES (?, ?, ?)", (key, bpm, mode))
+        db.commit()
+
+# Title cleanup used by the cache key: "(...)" chunks and " - Remastered/Live/..." suffixes
+_RE_PARENS = re.compile(r"\s*\(.*?\)|\s*-\s*(Remaster(ed)?|Live|Acoustic|Radio Edit|Mono|Stereo).*?$", re.I)
+_RE_WS = re.compile(r"\s+")
+
+def norm_keys(df):
+    """norm_key for every row at once (same normalization, done with .str ops)."""
+    title = df["Title"].astype(str).str.strip()
+    artist = df["Artist"].astype(str).str.strip()
+    t = (title.str.replace(_RE_PARENS, "", regex=True)
+              .str.replace(_RE_WS, " ", regex=True).str.strip())
+    a = artist.str.replace(_RE_WS, " ", regex=True).str.strip()
+    return (t + "|||" + a).str.lower()
 
 def norm_key(title, artist):
-    t = re.sub(r"\s*\(.*?\)|\s*-\s*(Remaster(ed)?|Live|Acoustic|Radio Edit|Mono|Stereo).*?$", "", title, flags=re.I)
-    t = re.sub(r"\s+", " ", t).strip()
-    a = re.sub(r"\s+", " ", artist).strip()
+    t = _RE_WS.sub(" ", _RE_PARENS.sub("", title)).strip()
+    a = _RE_WS.sub(" ", artist).strip()
     return f"{t}|||{a}".lower()
 
 def coerce_mode_from_key_str(keystr):
@@ -142,7 +285,7 @@ def coerce_mode_from_scale(scale):
         if int(scale) == 0: return "Minor"
     return None
 
-# ----- Helper: convert MP3 bytes -> temp WAV (for analyzers) -----
+# ----- Helper: convert MP3 bytes -> temp WAV (last-resort decode via pydub + ffmpeg) -----
 def write_temp_wav_from_mp3_bytes(mp3_bytes: bytes):
     """Convert MP3 bytes to a temporary WAV file path. Needs pydub + ffmpeg."""
     if not AudioSegment:
@@ -160,25 +303,111 @@ def write_temp_wav_from_mp3_bytes(mp3_bytes: bytes):
         except Exception: pass
         return None
 
-# ----- Local analyzers: BPM (madmom→librosa), Mode (pyACA→librosa) -----
-def analyze_file_bpm_madmom(wav_path):
-    if not (USE_MADMOM and wav_path):
+# ----- Helper: write an already decoded waveform to a temp WAV (madmom loads + resamples files) -----
+def write_temp_wav(y, sr):
+    if not (sf and y is not None):
         return None
+    tmp = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+    tmp.close()
     try:
-        act   = RNNBeatProcessor()(wav_path)
-        tempi = TempoEstimationProcessor()(act)  # [[bpm, weight], ...]
+        sf.write(tmp.name, y, sr)
+        return tmp.name
+    except Exception:
+        try: os.remove(tmp.name)
+        except Exception: pass
+        return None
+
+# ----- Helper: decode MP3 bytes in memory (no ffmpeg round trip) -----
+def decode_mp3_bytes(mp3_bytes: bytes):
+    """Decode MP3 bytes to a mono float32 array via libsndfile, else PyAV. Returns (y, sr) or (None, None)."""
+    if not np:
+        return None, None
+    if sf:
+        try:
+            y, sr = sf.read(io.BytesIO(mp3_bytes), dtype="float32", always_2d=False)
+            if y.ndim > 1:
+                y = y.mean(axis=1)
+            return y, sr
+        except Exception:
+            pass  # older libsndfile builds have no MP3 support
+    if av:
+        try:
+            with av.open(io.BytesIO(mp3_bytes)) as c:
+                stream = c.streams.audio[0]
+                frames = [f.to_ndarray() for f in c.decode(stream)]  # planar: (channels, samples)
+                sr = stream.rate
+            if frames:
+                y = np.concatenate(frames, axis=1).mean(axis=0)
+                return y.astype(np.float32), sr
+        except Exception:
+            pass
+    return None, None
+
+def load_preview_audio(mp3_bytes: bytes, need_bpm=True):
+    """
+    Decode a preview once for the array-based analyzers.
+    A temp WAV is only written for madmom when it will run on a non-44.1 kHz
+    preview, or via pydub/ffmpeg when in-memory decoding is unavailable.
+    Returns (y, sr, wav_path).
+    """
+    y, sr = decode_mp3_bytes(mp3_bytes)
+    wav_path = None
+    if y is None:
+        wav_path = write_temp_wav_from_mp3_bytes(mp3_bytes)
+        if librosa and wav_path:
+            try:
+                y, sr = librosa.load(wav_path, sr=None, mono=True)
+            except Exception:
+                y, sr = None, None
+    elif need_bpm and USE_MADMOM and sr != MADMOM_SR:
+        # madmom only resamples when it loads a file itself; 44.1 kHz arrays go in directly
+        wav_path = write_temp_wav(y, sr)
+    return y, sr, wav_path
+
+# ----- Local analyzers: BPM (madmom→librosa), Mode (pyACA→STFT chroma/librosa) -----
+def refine_tempo(beats):
+    """
+    Tempo from a straight-line fit of beat times against beat index (60 / slope),
+    which isn't quantized like TempoEstimationProcessor's histogram. Returns (bpm, r²).
+    """
+    if beats is None or len(beats) < 4:
+        return None, 0.0
+    fit = linregress(np.arange(len(beats)), beats)
+    if fit.slope <= 0:
+        return None, 0.0
+    return 60.0 / fit.slope, fit.rvalue ** 2
+
+def analyze_bpm_madmom(y, sr, wav_path=None):
+    """Feed the decoded array to madmom when it's at the model rate, else let it load the WAV."""
+    if not USE_MADMOM:
+        return None
+    if y is not None and sr == MADMOM_SR:
+        sig = Signal(y, sample_rate=sr)
+    elif wav_path:
+        sig = wav_path
+    else:
+        return None
+    rnn, tempo_proc, beat_proc = _madmom_processors()
+    if rnn is None:
+        return None
+    try:
+        act = rnn(sig)
+        if beat_proc is not None:
+            bpm, r2 = refine_tempo(beat_proc(act))
+            if bpm and r2 >= TEMPO_FIT_R2:
+                return bpm
+        tempi = tempo_proc(act)  # [[bpm, weight], ...]
         if hasattr(tempi, "__len__") and len(tempi) > 0:
             return float(tempi[0][0])
     except Exception:
         return None
     return None
 
-def analyze_file_bpm_librosa(wav_path):
-    if not (librosa and wav_path):
+def analyze_bpm_librosa(y, sr):
+    if not (librosa and y is not None):
         return None
     try:
         import numpy as np
-        y, sr = librosa.load(wav_path, sr=None, mono=True)
         onset_env = librosa.onset.onset_strength(y=y, sr=sr)
         tempo = librosa.beat.tempo(onset_envelope=onset_env, sr=sr, aggregate=None)
         if tempo is not None and len(tempo):
@@ -188,92 +417,147 @@ def analyze_file_bpm_librosa(wav_path):
     return None
 
 
-def analyze_file_mode_pyaca(wav_path):
-    if not (USE_PYACA and sf and np and computeKey and wav_path):
+def analyze_mode_pyaca(y, sr):
+    if not (USE_PYACA and computeKey and y is not None):
         return None
     try:
-        x, fs = sf.read(wav_path, always_2d=False)
-        if x is None or fs is None:
-            return None
-        if hasattr(x, "ndim") and getattr(x, "ndim", 1) > 1:
-            x = np.mean(x, axis=1)
-        key_str, strength = computeKey(x, fs)  # e.g., "C major"
+        key_str, strength = computeKey(y, sr)  # e.g., "C major"
         return coerce_mode_from_key_str(key_str)
     except Exception:
         return None
 
-def analyze_file_mode_librosa(wav_path):
-    if not (librosa and wav_path):
+# Krumhansl-Kessler key profiles, tonic at index 0 (C major / C minor)
+_KK_MAJOR = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+_KK_MINOR = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+
+def _key_profiles():
+    """24×12 matrix of the profiles rotated to every tonic, centered and unit-norm (rows 0-11 major)."""
+    p = np.array([np.roll(prof, k) for prof in (_KK_MAJOR, _KK_MINOR) for k in range(12)], dtype=float)
+    p -= p.mean(axis=1, keepdims=True)
+    return p / np.linalg.norm(p, axis=1, keepdims=True)
+
+_KEY_PROFILES = _key_profiles() if np else None
+
+def krumhansl_mode(chroma_mean):
+    """Mode of the best-correlating key for a 12-bin mean chroma (one 24×12 matvec)."""
+    c = np.asarray(chroma_mean, dtype=float)
+    c = c - c.mean()
+    norm = np.linalg.norm(c)
+    if not np.isfinite(norm) or norm == 0:
+        return None  # silent/flat chroma: no key to speak of
+    corr = _KEY_PROFILES @ (c / norm)
+    return "Major" if int(np.argmax(corr)) < 12 else "Minor"
+
+CHROMA_NPERSEG = 4096
+CHROMA_FMIN, CHROMA_FMAX = 55.0, 5000.0  # A1..~D#8; below is rumble, above is mostly noise/harmonics
+
+@functools.lru_cache(maxsize=8)
+def _stft_pitch_classes(sr, nperseg=CHROMA_NPERSEG):
+    """(bin mask, pitch class per kept bin) for an STFT at this sample rate, C = 0."""
+    f = np.fft.rfftfreq(nperseg, d=1.0 / sr)
+    keep = (f >= CHROMA_FMIN) & (f <= CHROMA_FMAX)
+    midi = 12 * np.log2(f[keep] / 440.0) + 69
+    return keep, np.mod(np.round(midi), 12).astype(int)
+
+def chroma_mean_stft(y, sr):
+    """Mean 12-bin chroma from a plain scipy STFT (magnitude folded onto pitch classes)."""
+    _, _, Z = stft(y, fs=sr, nperseg=CHROMA_NPERSEG)
+    keep, pc = _stft_pitch_classes(sr)
+    mag = np.abs(Z[keep]).mean(axis=1)  # averaging frames first == mean of the per-frame chroma
+    return np.bincount(pc, weights=mag, minlength=12)
+
+def analyze_mode_chroma(y, sr):
+    """Krumhansl mode from an STFT chroma (scipy), falling back to librosa's chroma_cqt."""
+    if y is None:
         return None
     try:
-        y, sr = librosa.load(wav_path, sr=None, mono=True)
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-        maj  = chroma[[0,4,7], :].mean()   # C-E-G proxy
-        minr = chroma[[0,3,7], :].mean()   # C-Eb-G proxy
-        return "Major" if maj >= minr else "Minor"
+        if stft is not None and np is not None:
+            return krumhansl_mode(chroma_mean_stft(y, sr))
+        if librosa:
+            return krumhansl_mode(librosa.feature.chroma_cqt(y=y, sr=sr).mean(axis=1))
     except Exception:
         return None
+    return None
 
-# ---------- Provider 1: Deezer (BPM) ----------
-def fetch_deezer_bpm(title, artist, retries=2):
+# ----- Shared preview analysis: one decode, only the analyzers that are needed -----
+def analyze_preview_audio(mp3_bytes: bytes, need_bpm=True, need_mode=True):
+    """
+    Decode a preview once and run the BPM/mode analyzers off the same (y, sr).
+    Returns (bpm, mode, bpm_by, mode_by); *_by names the analyzer that produced each value.
+    """
+    y, sr, wav_path = load_preview_audio(mp3_bytes, need_bpm)
+    bpm = mode = bpm_by = mode_by = None
+    try:
+        # tempo and chroma are independent; skip the (expensive) one we don't need
+        if need_bpm:
+            bpm, bpm_by = analyze_bpm_madmom(y, sr, wav_path), "madmom"
+            if not bpm:
+                bpm, bpm_by = analyze_bpm_librosa(y, sr), "librosa"
+        if need_mode:
+            mode, mode_by = analyze_mode_pyaca(y, sr), "pyACA"
+            if not mode:
+                mode = analyze_mode_chroma(y, sr)
+                mode_by = "chroma-ks" if (stft is not None and np is not None) else "librosa-ks"
+        return bpm, mode, (bpm_by if bpm else None), (mode_by if mode else None)
+    finally:
+        if wav_path and os.path.exists(wav_path):
+            try: os.remove(wav_path)
+            except Exception: pass
+
+# ---------- Provider 1: Deezer (BPM + 30s preview) ----------
+def fetch_deezer_track(title, artist):
+    """First Deezer search hit; one lookup serves both the numeric BPM and the preview url."""
     # No key required. API: https://api.deezer.com/search?q=track:"..." artist:"..."
     q = f'track:"{title}" artist:"{artist}"'
     url = "https://api.deezer.com/search"
     params = {"q": q, "limit": 1}
-    for attempt in range(retries+1):
-        try:
-            r = requests.get(url, params=params, timeout=5)
-            if r.status_code == 200:
-                data = r.json() or {}
-                items = data.get("data") or []
-                if items:
-                    it = items[0]
-                    bpm = it.get("bpm")
-                    # Deezer sometimes returns 0; treat as missing
-                    if bpm and float(bpm) > 0:
-                        return float(bpm)
-                    return None
-            elif r.status_code in (429, 500, 502, 503):
-                time.sleep(0.6 * (attempt + 1))
-                continue
-        except Exception:
-            time.sleep(0.4)
+    try:
+        r = http_get(url, params=params, timeout=8)
+        if r.status_code == 200:
+            data = r.json() or {}
+            items = data.get("data") or []
+            if items:
+                return items[0]
+    except Exception:
+        pass
+    return None
+
+def deezer_bpm(track):
+    bpm = (track or {}).get("bpm")
+    try:
+        # Deezer sometimes returns 0; treat as missing
+        if bpm and float(bpm) > 0:
+            return float(bpm)
+    except Exception:
+        pass
     return None
 
 # ---------- Provider 2: MusicBrainz → AcousticBrainz (Mode / Key / BPM) ----------
-def fetch_musicbrainz_recording_id(title, artist, retries=2):
+def fetch_musicbrainz_recording_id(title, artist):
     # Public JSON API (rate-limited). We do a simple recording search.
     url = "https://musicbrainz.org/ws/2/recording"
     params = {"query": f'"{title}" AND artist:"{artist}"', "fmt": "json", "limit": 1}
-    headers = {"User-Agent": "MusicTherapyDataPipeline/1.0 (contact: you@example.com)"}
-    for attempt in range(retries+1):
-        try:
-            r = requests.get(url, params=params, headers=headers, timeout=15)
-            if r.status_code == 200:
-                j = r.json() or {}
-                recs = j.get("recordings") or []
-                if recs:
-                    return recs[0].get("id")
-            time.sleep(0.5 * (attempt + 1))
-        except Exception:
-            time.sleep(0.5)
+    try:
+        r = http_get(url, params=params, timeout=15)
+        if r.status_code == 200:
+            j = r.json() or {}
+            recs = j.get("recordings") or []
+            if recs:
+                return recs[0].get("id")
+    except Exception:
+        pass
     return None
 
-def fetch_acousticbrainz_highlevel(mbid, retries=1):
+def fetch_acousticbrainz_highlevel(mbid):
     # AcousticBrainz high-level endpoint (if available)
     # Note: The project has reduced availability; handle 404/5xx gracefully.
     url = f"https://acousticbrainz.org/{mbid}/high-level"
-    for attempt in range(retries+1):
-        try:
-            r = requests.get(url, timeout=15)
-            if r.status_code == 200:
-                return r.json() or {}
-            elif r.status_code in (404, 410):
-                return None
-            else:
-                time.sleep(0.6 * (attempt + 1))
-        except Exception:
-            time.sleep(0.5)
+    try:
+        r = http_get(url, timeout=15)
+        if r.status_code == 200:
+            return r.json() or {}
+    except Exception:
+        pass
     return None
 
 def interpret_acousticbrainz_mode(data):
@@ -327,33 +611,29 @@ def fetch_mode_from_acousticbrainz(title, artist):
     return mode, key_str, bpm
 
 # ---------- Provider 3: GetSongBPM ----------
-def fetch_getsongbpm(title, artist, retries=2):
+def fetch_getsongbpm(title, artist):
     if not GETSONGBPM_API_KEY:
         return None, None
     url = "https://api.getsongbpm.com/search/"
     params = {"api_key": GETSONGBPM_API_KEY, "type": "both", "lookup": f"{title} {artist}"}
-    for attempt in range(retries+1):
-        try:
-            r = requests.get(url, params=params, timeout=15)
-            if r.status_code == 200:
-                j = r.json() or {}
-                items = j.get("search") or j.get("result") or []
-                if items:
-                    it = items[0]
-                    bpm = it.get("tempo") or it.get("bpm")
-                    key = it.get("key") or it.get("song_key")
-                    mode = coerce_mode_from_key_str(key)
-                    try:
-                        if bpm is not None:
-                            bpm = float(bpm)
-                    except Exception:
-                        bpm = None
-                    return bpm, mode
-            elif r.status_code in (429, 500, 502, 503):
-                time.sleep(0.6 * (attempt + 1))
-                continue
-        except Exception:
-            time.sleep(0.4)
+    try:
+        r = http_get(url, params=params, timeout=15)
+        if r.status_code == 200:
+            j = r.json() or {}
+            items = j.get("search") or j.get("result") or []
+            if items:
+                it = items[0]
+                bpm = it.get("tempo") or it.get("bpm")
+                key = it.get("key") or it.get("song_key")
+                mode = coerce_mode_from_key_str(key)
+                try:
+                    if bpm is not None:
+                        bpm = float(bpm)
+                except Exception:
+                    bpm = None
+                return bpm, mode
+    except Exception:
+        pass
     return None, None
 
 # ---------- Provider 4: iTunes preview + Local analysis ----------
@@ -362,139 +642,71 @@ def itunes_preview_url(title, artist):
     params = {"term": f"{title} {artist}", "media": "music", "entity": "song", "limit": 1, "country": "US"}
 
     try:
-        r = requests.get(url, params=params, timeout=15)
+        r = http_get(url, params=params, timeout=15)
         if r.status_code == 200 and r.json().get("results"):
             return r.json()["results"][0].get("previewUrl")
     except Exception:
         pass
     return None
-def analyze_preview(title, artist, retries=1):
-    """Fetch iTunes preview and analyze BPM/mode locally with librosa or madmom."""
+MIN_PREVIEW_BYTES = 5000  # anything smaller is an error page / stub, not 30 s of MP3
+
+def _download_preview(url):
+    """
+    Preview body, or None when the GET's own Content-Length already says it's too small —
+    the response is streamed, so in that case the body is never transferred.
+    """
+    with http_get(url, timeout=10, stream=True) as r:
+        n = r.headers.get("Content-Length", "")
+        if n.isdigit() and int(n) < MIN_PREVIEW_BYTES:
+            return None
+        return r.content
+
+def analyze_preview(title, artist, need_bpm=True, need_mode=True):
+    """Fetch iTunes preview and analyze BPM/mode locally with librosa or madmom (only what is needed)."""
     url = itunes_preview_url(title, artist)
     if not url:
         print(f"⚠️ No iTunes preview found for {title} – {artist}")
-        return None, None
-
-    wav_path = None
-    for attempt in range(retries + 1):
-        try:
-            print(f"🎧 Downloading preview for {title} – {artist} (attempt {attempt + 1})", flush=True)
-            r = requests.get(url, timeout=10, stream=True)
-            audio = r.content
-            # ⬇️  THIS IS THE NEW SIZE CHECK
-            if not audio or len(audio) < 5000:
-                print(f"⚠️ iTunes preview too small ({len(audio) if audio else 0} B) for {title} – {artist}", flush=True)
-                return None, None
-
-            wav_path = write_temp_wav_from_mp3_bytes(audio)
-            bpm  = analyze_file_bpm_madmom(wav_path) or analyze_file_bpm_librosa(wav_path)
-            mode = analyze_file_mode_pyaca(wav_path) or analyze_file_mode_librosa(wav_path)
-
-            if bpm or mode:
-                print(f"✅ iTunes preview analysis: {title} – {artist} | BPM={bpm}, Mode={mode}", flush=True)
-            else:
-                print(f"⚠️ Analysis returned no data for {title} – {artist}", flush=True)
-            return bpm, mode
-
-        except Exception as e:
-            print(f"⚠️ Error analyzing preview for {title} – {artist}: {e}", flush=True)
-            time.sleep(0.5)
-
-        finally:
-            if wav_path and os.path.exists(wav_path):
-                try: os.remove(wav_path)
-                except Exception: pass
-
-    print(f"⚠️ All preview attempts failed for {title} – {artist}")
-    return None, None
-
-
-    wav_path = None
-    for attempt in range(retries + 1):
-        try:
-            print(f"🎧 Downloading preview for {title} – {artist} (attempt {attempt + 1})", flush=True)
-            r = requests.get(url, timeout=10, stream=True)
-            audio = r.content
-            if len(audio) < 5000:
-                print(f"⚠️ Preview too small ({len(audio)} bytes) for {title} – {artist}; skipping.", flush=True)
-                return None, None
-
-            wav_path = write_temp_wav_from_mp3_bytes(audio)
-            ...
+        return None, None, None, None
 
-            ...
-
-
-            # Run local analyzers
-            bpm = analyze_file_bpm_madmom(wav_path) or analyze_file_bpm_librosa(wav_path)
-            mode = analyze_file_mode_pyaca(wav_path) or analyze_file_mode_librosa(wav_path)
-
-            if bpm or mode:
-                print(f"✅ Preview analysis complete: {title} – {artist} | BPM={bpm}, Mode={mode}", flush=True)
-            else:
-                print(f"⚠️ Analysis returned no data for {title} – {artist}", flush=True)
+    try:
+        print(f"🎧 Downloading preview for {title} – {artist}", flush=True)
+        audio = _download_preview(url)
+        # ⬇️  THIS IS THE NEW SIZE CHECK
+        if not audio or len(audio) < MIN_PREVIEW_BYTES:
+            print(f"⚠️ iTunes preview too small ({len(audio) if audio else 0} B) for {title} – {artist}", flush=True)
+            return None, None, None, None
 
-            return bpm, mode
+        bpm, mode, bpm_by, mode_by = analyze_preview_audio(audio, need_bpm, need_mode)
 
-        except Exception as e:
-            print(f"⚠️ Error analyzing preview for {title} – {artist}: {e}", flush=True)
-            time.sleep(0.5)
+        if bpm or mode:
+            print(f"✅ iTunes preview analysis: {title} – {artist} | BPM={bpm}, Mode={mode}", flush=True)
+        else:
+            print(f"⚠️ Analysis returned no data for {title} – {artist}", flush=True)
+        return bpm, mode, bpm_by, mode_by
 
-        finally:
-            if wav_path and os.path.exists(wav_path):
-                try:
-                    os.remove(wav_path)
-                except Exception:
-                    pass
+    except Exception as e:
+        print(f"⚠️ Error analyzing preview for {title} – {artist}: {e}", flush=True)
+        return None, None, None, None
 
-    print(f"⚠️ All preview attempts failed for {title} – {artist}")
-    return None, None
 
-def fetch_deezer_preview_url(title, artist, retries=2):
-    """Return a 30s MP3 preview url from Deezer search (public)."""
-    q = f'track:"{title}" artist:"{artist}"'
-    url = "https://api.deezer.com/search"
-    params = {"q": q, "limit": 1}
-    for attempt in range(retries + 1):
-        try:
-            r = requests.get(url, params=params, timeout=8)
-            if r.status_code == 200:
-                data = r.json() or {}
-                items = data.get("data") or []
-                if items:
-                    return items[0].get("preview")  # direct MP3 30s
-            elif r.status_code in (429, 500, 502, 503):
-                time.sleep(0.5 * (attempt + 1))
-        except Exception:
-            time.sleep(0.4)
-    return None
-
-def analyze_preview_from_url(preview_url, title, artist):
-    """Download MP3 preview from a url, convert to wav, run local analyzers."""
+def analyze_preview_from_url(preview_url, title, artist, need_bpm=True, need_mode=True):
+    """Download MP3 preview from a url, decode it, run the local analyzers that are needed."""
     if not preview_url:
-        return None, None
-    wav_path = None
+        return None, None, None, None
     try:
-        r = requests.get(preview_url, timeout=10, stream=True)
-        audio = r.content
-        if not audio or len(audio) < 5000:
+        audio = _download_preview(preview_url)
+        if not audio or len(audio) < MIN_PREVIEW_BYTES:
             print(f"⚠️ Preview too small ({len(audio) if audio else 0} B) for {title} – {artist}", flush=True)
-            return None, None
-        wav_path = write_temp_wav_from_mp3_bytes(audio)
-        bpm  = analyze_file_bpm_madmom(wav_path) or analyze_file_bpm_librosa(wav_path)
-        mode = analyze_file_mode_pyaca(wav_path) or analyze_file_mode_librosa(wav_path)
+            return None, None, None, None
+        bpm, mode, bpm_by, mode_by = analyze_preview_audio(audio, need_bpm, need_mode)
         if bpm or mode:
             print(f"✅ Deezer preview analysis: {title} – {artist} | BPM={bpm}, Mode={mode}", flush=True)
         else:
             print(f"⚠️ Deezer preview analysis returned no data for {title} – {artist}", flush=True)
-        return bpm, mode
+        return bpm, mode, bpm_by, mode_by
     except Exception as e:
         print(f"⚠️ Deezer preview analyze error for {title} – {artist}: {e}", flush=True)
-        return None, None
-    finally:
-        if wav_path and os.path.exists(wav_path):
-            try: os.remove(wav_path)
-            except Exception: pass
+        return None, None, None, None
 
 
 # ---------- Enrichment chain (ONLY overwrite if missing; cache clean values) ----------
@@ -505,16 +717,19 @@ def enrich_row(row, cache):
     """
     title = str(row.get("Title", "")).strip()
     artist = str(row.get("Artist", "")).strip()
-    key = norm_key(title, artist)
+    key = row["_norm_key"]  # precomputed for the whole frame by norm_keys() in main
 
     # normalize current values
     bpm  = None if is_missing(row.get("BPM"))  else row.get("BPM")
     mode = None if is_missing(row.get("Mode")) else row.get("Mode")
-    bpm_src, mode_src = None, None
+    # a value that's already filled (input or the up-front cache merge) keeps its label
+    bpm_src  = None if bpm  is None or is_missing(row.get("BPM Source"))  else row.get("BPM Source")
+    mode_src = None if mode is None or is_missing(row.get("Mode Source")) else row.get("Mode Source")
 
     # 0) cache
-    if key in cache:
-        cached = cache[key] or {}
+    cached = cache_get(cache, key)
+    if cached is not None:
+        cached = cached or {}
         if is_missing(bpm)  and not is_missing(cached.get("BPM")):
             bpm,  bpm_src  = cached.get("BPM"),  "cache"
         if is_missing(mode) and not is_missing(cached.get("Mode")):
@@ -527,10 +742,15 @@ def enrich_row(row, cache):
     # -------------------- TRY PROVIDERS --------------------
     print("➡️  PROVIDERS PATH ENTERED", flush=True)
 
+    # one Deezer search feeds steps 1 and 2
+    dz_track = None
+    if is_missing(bpm) or is_missing(mode):
+        dz_track = fetch_deezer_track(title, artist)
+
     # 1) Deezer numeric BPM (rare, but trivial to try)
     if is_missing(bpm):
         print("… trying Deezer BPM", flush=True)
-        bpm_try = fetch_deezer_bpm(title, artist)
+        bpm_try = deezer_bpm(dz_track)
         if not is_missing(bpm_try):
             bpm = float(bpm_try); bpm_src = bpm_src or "Deezer(bpm)"
             log(f"Deezer BPM: {title} - {artist} → {bpm}")
@@ -538,14 +758,15 @@ def enrich_row(row, cache):
     # 2) Deezer preview (HIGH YIELD) → local librosa/madmom
     if is_missing(bpm) or is_missing(mode):
         print("… trying Deezer preview", flush=True)
-        dz_prev = fetch_deezer_preview_url(title, artist)
+        dz_prev = (dz_track or {}).get("preview")  # direct MP3 30s
         if dz_prev:
-            pbpm, pmode = analyze_preview_from_url(dz_prev, title, artist)
+            pbpm, pmode, pbpm_by, pmode_by = analyze_preview_from_url(
+                dz_prev, title, artist, need_bpm=is_missing(bpm), need_mode=is_missing(mode))
             if is_missing(bpm)   and (pbpm is not None):
-                bpm = float(pbpm);   bpm_src  = bpm_src  or ("madmom" if USE_MADMOM else "librosa(deezer)")
+                bpm = float(pbpm);   bpm_src  = bpm_src  or f"{pbpm_by}(deezer)"
                 log(f"Deezer Preview BPM: {title} - {artist} → {bpm}")
             if is_missing(mode) and (pmode is not None):
-                mode = str(pmode); mode_src = mode_src or ("pyACA"  if USE_PYACA  else "librosa(deezer)")
+                mode = str(pmode); mode_src = mode_src or f"{pmode_by}(deezer)"
                 log(f"Deezer Preview Mode: {title} - {artist} → {mode}")
         else:
             print("   (no Deezer preview url)", flush=True)
@@ -564,12 +785,13 @@ def enrich_row(row, cache):
     # 4) iTunes preview (sometimes blocked; still try)
     if is_missing(bpm) or is_missing(mode):
         print("… trying iTunes preview", flush=True)
-        pbpm, pmode = analyze_preview(title, artist)
+        pbpm, pmode, pbpm_by, pmode_by = analyze_preview(title, artist,
+                                                         need_bpm=is_missing(bpm), need_mode=is_missing(mode))
         if is_missing(bpm) and (pbpm is not None):
-            bpm = float(pbpm); bpm_src = bpm_src or ("madmom" if USE_MADMOM else "librosa(itunes)")
+            bpm = float(pbpm); bpm_src = bpm_src or f"{pbpm_by}(itunes)"
             log(f"iTunes Preview BPM: {title} - {artist} → {bpm}")
         if is_missing(mode) and (pmode is not None):
-            mode = str(pmode); mode_src = mode_src or ("pyACA"  if USE_PYACA  else "librosa(itunes)")
+            mode = str(pmode); mode_src = mode_src or f"{pmode_by}(itunes)"
             log(f"iTunes Preview Mode: {title} - {artist} → {mode}")
 
     # -------------------- FINALIZE --------------------
@@ -588,47 +810,101 @@ def enrich_row(row, cache):
     row["Mode Source"] = mode_src
 
     # cache clean values for reuse
-    cache[key] = {"BPM": bpm_clean, "Mode": mode_clean}
+    cache_put(cache, key, bpm_clean, mode_clean)
     return row
 
 # ---------- Main ----------
+def _missing_mask(s):
+    """Column-wise is_missing(): NaN/None or blank string."""
+    return s.isna() | s.astype(str).str.strip().eq("")
+
 def main():
     if not os.path.exists(INPUT_CSV):
         raise SystemExit(f"❌ {INPUT_CSV} not found. Run your step1 search first.")
-    df = pd.read_csv(INPUT_CSV)
-
-    # Normalize NaN-like values to None
-    df = df.replace({pd.NA: None})
-    df = df.where(pd.notna(df), None)
+    # nullable dtypes: blanks come back as pd.NA directly, which is_missing() already treats as missing
+    df = pd.read_csv(INPUT_CSV, dtype=INPUT_DTYPES)
 
     # tolerate either "Source link" or "Source Link"
     if "Source link" in df.columns and "Source Link" not in df.columns:
         df.rename(columns={"Source link": "Source Link"}, inplace=True)
 
+    # cache keys for all rows up front (vectorized), dropped again before writing
+    df["_norm_key"] = norm_keys(df)
+    for c in ("BPM", "Mode", "BPM Source", "Mode Source"):
+        if c not in df.columns:
+            df[c] = pd.Series(pd.NA, index=df.index, dtype=INPUT_DTYPES[c])
+
+    # fill cache hits for the whole frame in one merge; only the rest go to the network
     cache = load_cache()
-    rows = []
-    log("🚀 Enriching BPM/Mode via Deezer → AcousticBrainz → GetSongBPM → iTunes+local")
-    for i, (_, r) in enumerate(df.iterrows(), 1):  # limit to 5 rows for debug
+    cache_df = pd.DataFrame([{"_norm_key": k, "BPM_c": v.get("BPM"), "Mode_c": v.get("Mode")}
+                             for k, v in cache.items()],
+                            columns=["_norm_key", "BPM_c", "Mode_c"])
+    df = df.merge(cache_df, on="_norm_key", how="left")
+    for col, ccol, src in (("BPM", "BPM_c", "BPM Source"), ("Mode", "Mode_c", "Mode Source")):
+        hit = _missing_mask(df[col]) & df[ccol].notna()
+        df.loc[hit, col] = df.loc[hit, ccol]
+        df.loc[hit, src] = "cache"
+    df = df.drop(columns=["BPM_c", "Mode_c"])
+
+    todo = df[_missing_mask(df["BPM"]) | _missing_mask(df["Mode"])]
+    # repeats of a song (same key) are enriched once, then copied onto the other rows
+    first = todo.drop_duplicates(subset=["_norm_key"])
+    total = len(first)
+    log(f"ℹ️ {len(df) - len(todo)} rows already complete (input/cache), "
+        f"{total} unique songs to enrich ({len(todo) - total} repeats)")
+
+    def enrich_one(item):
+        i, r = item
         title, artist = r.get("Title"), r.get("Artist")
-        print(f"\n🎵 Processing {i}/{len(df)}: {title} – {artist}", flush=True)
+        print(f"\n🎵 Processing {i}/{total}: {title} – {artist}", flush=True)
         try:
             r = enrich_row(r, cache)
             print(f"✅ Finished {title} – {artist}", flush=True)
         except Exception as e:
             print(f"⚠️ Enrich error on {title} – {artist}: {e}", flush=True)
             print(traceback.format_exc())
-        rows.append(r)
-        time.sleep(SLEEP_SHORT)  # be nice to public APIs
-        if i % 25 == 0:
-            save_cache(cache)
-
-
-    out = pd.DataFrame(rows)
-    out.to_csv(OUTPUT_CSV, index=False)
-    save_cache(cache)
-    log(f"✅ Saved {OUTPUT_CSV} with {len(out)} rows.")
-    missing_bpm = int(out['BPM'].isna().sum()) if 'BPM' in out.columns else 0
-    missing_mode = int(out['Mode'].isna().sum()) if 'Mode' in out.columns else 0
+        return r
+
+    log("🚀 Enriching BPM/Mode via Deezer → AcousticBrainz → GetSongBPM → iTunes+local")
+    # plain dict rows (no per-row Series boxing); enrich_row only needs .get / item assignment
+    items = list(enumerate(first.to_dict("records"), 1))
+    repeats = {}
+    for r in todo.loc[todo.index.difference(first.index)].to_dict("records"):
+        repeats.setdefault(r["_norm_key"], []).append(r)
+
+    # rows go to disk as soon as they're final: the complete ones first, then
+    # enriched songs (plus their repeats) in completion order
+    fieldnames = [c for c in df.columns if c != "_norm_key"]
+    written = missing_bpm = missing_mode = 0
+    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as fh:
+        w = csv.DictWriter(fh, fieldnames=fieldnames, extrasaction="ignore")
+        w.writeheader()
+
+        def emit(r):
+            nonlocal written, missing_bpm, missing_mode
+            w.writerow({k: csv_value(r.get(k)) for k in fieldnames})
+            written += 1
+            missing_bpm += is_missing(r.get("BPM"))
+            missing_mode += is_missing(r.get("Mode"))
+
+        for r in df.drop(index=todo.index).to_dict("records"):
+            emit(r)
+        fh.flush()
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            futures = [ex.submit(enrich_one, item) for item in items]
+            for fut in as_completed(futures):  # only this thread writes, so no lock on the writer
+                r = fut.result()
+                emit(r)
+                # repeats of the song keep their own values and take the rest from this result
+                for dup in repeats.get(r["_norm_key"], ()):
+                    for col, src in (("BPM", "BPM Source"), ("Mode", "Mode Source")):
+                        if is_missing(dup.get(col)) and not is_missing(r.get(col)):
+                            dup[col], dup[src] = r.get(col), r.get(src)
+                    emit(dup)
+                fh.flush()
+
+    log(f"✅ Saved {OUTPUT_CSV} with {written} rows.")
     log(f"ℹ️ Missing BPM: {missing_bpm} | Missing Mode: {missing_mode}")
 
 if __name__ == "__main__":
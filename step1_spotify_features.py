@@ -1,10 +1,11 @@
 import os, sys, time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import spotipy
-import time
 from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyClientCredentials
 from dotenv import load_dotenv
+from pipeline_utils import RateLimiter
 
 # ---------- Setup ----------
 load_dotenv()
@@ -29,31 +30,55 @@ df_in["Artist"] = df_in["Artist"].astype(str).str.strip()
 df_in = df_in[(df_in["Title"]!="") & (df_in["Artist"]!="")]
 
 # ---------- Search ----------
+SEARCH_WORKERS = 10
+SEARCH_RATE = 10  # requests/s across all workers; Spotify limits over a rolling 30 s window
+
+_search_limiter = RateLimiter(SEARCH_RATE)
+
+def search_one(title, artist, retries=3):
+    """One paced sp.search; backs off on 429 (Retry-After) and 5xx. Returns the track items."""
+    query = f'track:"{title}" artist:"{artist}"'  # exact-ish search
+    for attempt in range(retries + 1):
+        _search_limiter.wait()
+        try:
+            # You can remove market="US" if needed:
+            res = sp.search(q=query, type="track", limit=1)  # , market="US"
+            return res.get("tracks", {}).get("items", [])
+        except SpotifyException as e:
+            status = e.http_status or 0
+            if attempt < retries and (status == 429 or status >= 500):
+                retry_after = (getattr(e, "headers", None) or {}).get("Retry-After")
+                try:
+                    time.sleep(float(retry_after) if retry_after else 2 ** attempt)
+                except ValueError:
+                    time.sleep(2 ** attempt)
+                continue
+            print("⚠️ Search error:", title, "-", artist, "→", e)
+            return []
+    return []
+
 print("🔎 Searching Spotify for tracks …")
 hits_rows, not_found = [], []
-for _, r in df_in.iterrows():
-    title, artist = r["Title"], r["Artist"]
-    query = f'track:"{title}" artist:"{artist}"'  # exact-ish search
-    try:
-        # You can remove market="US" if needed:
-        res = sp.search(q=query, type="track", limit=1)  # , market="US"
-        items = res.get("tracks", {}).get("items", [])
-    except SpotifyException as e:
-        print("⚠️ Search error:", title, "-", artist, "→", e)
-        items = []
-
-    if items:
-        t = items[0]
-        hits_rows.append({
-            "Title": title,
-            "Artist": artist,
-            "Track ID": t["id"],
-            "Source link": t["external_urls"]["spotify"],
-            "Found Title": t["name"],
-            "Found Artist(s)": ", ".join(a["name"] for a in t["artists"])
-        })
-    else:
-        not_found.append(f"{title} - {artist}")
+with ThreadPoolExecutor(max_workers=SEARCH_WORKERS) as ex:
+    # map() yields in input order, so the hit list and not-found list keep the CSV order
+    # each distinct (Title, Artist) is searched once; repeats reuse the answer
+    uniq = df_in[["Title", "Artist"]].drop_duplicates()
+    u_titles, u_artists = uniq["Title"].tolist(), uniq["Artist"].tolist()
+    found = dict(zip(zip(u_titles, u_artists), ex.map(search_one, u_titles, u_artists)))
+    for title, artist in zip(df_in["Title"], df_in["Artist"]):
+        items = found[(title, artist)]
+        if items:
+            t = items[0]
+            hits_rows.append({
+                "Title": title,
+                "Artist": artist,
+                "Track ID": t["id"],
+                "Source link": t["external_urls"]["spotify"],
+                "Found Title": t["name"],
+                "Found Artist(s)": ", ".join(a["name"] for a in t["artists"])
+            })
+        else:
+            not_found.append(f"{title} - {artist}")
 
 df_hits = pd.DataFrame(hits_rows)
 if df_hits.empty:
@@ -66,37 +91,39 @@ if not_found:
     print(f"⚠️ Not found: {len(not_found)} (see step1_not_found.txt)")
 
 # ---------- Audio features (with fallback to audio_analysis) ----------
-print("🎛  Fetching audio features (single-ID mode, with fallback) …")
+print("🎛  Fetching audio features (batches of 100, with fallback) …")
 features_rows, failed_ids = [], []
+AF_BATCH = 100  # max ids per /v1/audio-features call
+
+def chunks(lst, n):
+    for i in range(0, len(lst), n):
+        yield lst[i:i + n]
 
-def get_features_single(track_id, retries=2, delay=0.5):
+def get_features_batch(track_ids, retries=2, delay=0.5):
     """
-    Try audio_features first; if it fails or returns None, fall back to audio_analysis.
-    Returns a dict with keys: BPM, Mode, Valence (Spotify) — or None on total failure.
+    audio_features for up to AF_BATCH ids in one call.
+    Returns a list aligned with track_ids: dict with BPM, Mode, Valence (Spotify), or None where
+    Spotify had nothing (or after repeated failures) so the caller can fall back per id.
     """
-    # 1) Primary: audio_features
     for attempt in range(retries + 1):
         try:
-            f = sp.audio_features([track_id])[0]
-            if f:
-                return {
-                    "BPM": f.get("tempo"),
-                    "Mode": "Major" if f.get("mode") == 1 else "Minor" if f.get("mode") == 0 else None,
-                    "Valence (Spotify)": f.get("valence"),
-                }
-            # If None, retry (rare transient) or fall through to fallback
-        except SpotifyException as e:
+            feats = sp.audio_features(track_ids) or []
+            return [{
+                "BPM": f.get("tempo"),
+                "Mode": "Major" if f.get("mode") == 1 else "Minor" if f.get("mode") == 0 else None,
+                "Valence (Spotify)": f.get("valence"),
+            } if f else None for f in feats] + [None] * (len(track_ids) - len(feats))
+        except Exception:
             # e.g., 403 in some environments — don't fail hard; try again then fallback
             if attempt < retries:
                 time.sleep(delay)
-                continue
-        except Exception as e:
-            if attempt < retries:
-                time.sleep(delay)
-                continue
-        break  # move to fallback
+    return [None] * len(track_ids)
 
-    # 2) Fallback: audio_analysis (tempo/mode/key live under analysis["track"])
+def get_features_analysis(track_id, retries=2, delay=0.5):
+    """
+    Fallback: audio_analysis (tempo/mode/key live under analysis["track"]).
+    Returns a dict with keys: BPM, Mode, Valence (Spotify) — or None on total failure.
+    """
     for attempt in range(retries + 1):
         try:
             a = sp.audio_analysis(track_id)
@@ -120,16 +147,22 @@ def get_features_single(track_id, retries=2, delay=0.5):
                 continue
             return None
 
-for _, meta in df_hits.iterrows():
-    tid = meta["Track ID"]
-    f = get_features_single(tid)
+# one audio_features call per 100 ids; audio_analysis only for the ids it had nothing for
+feats_by_id = {}
+for chunk in chunks(df_hits["Track ID"].unique().tolist(), AF_BATCH):
+    for tid, f in zip(chunk, get_features_batch(chunk)):
+        feats_by_id[tid] = f or get_features_analysis(tid)
+
+for tid, title, artist, link in zip(df_hits["Track ID"], df_hits["Title"],
+                                    df_hits["Artist"], df_hits["Source link"]):
+    f = feats_by_id.get(tid)
 
     # Build output row, ensuring BPM/Mode/Valence columns exist
     row = {
         "Track ID": tid,
-        "Title": meta["Title"],
-        "Artist": meta["Artist"],
-        "Source link": meta["Source link"],
+        "Title": title,
+        "Artist": artist,
+        "Source link": link,
         "BPM": None,
         "Mode": None,
         "Valence (Spotify)": None,
@@ -140,8 +173,6 @@ for _, meta in df_hits.iterrows():
         failed_ids.append(tid)
 
     features_rows.append(row)
-    # polite pacing
-    time.sleep(0.1)
 
 df_out = pd.DataFrame(features_rows)
 # Make sure key columns exist even if all None (edge cases)
@@ -1,69 +1,136 @@
 #!/usr/bin/env python3
-import os, re, csv, json, time, random
-import pandas as pd
+import os, re, csv, asyncio, sqlite3, functools
+from urllib.parse import quote
+from difflib import SequenceMatcher
+import numpy as np
 from dotenv import load_dotenv
+from pipeline_utils import AsyncRateLimiter, csv_value, json_dumps, json_loads, read_csv_text
 
 # ---------- Config ----------
 INPUT_CSV  = "step1_enriched.csv"
 OUTPUT_CSV = "step2_lyrics_output.csv"
-CACHE_JSON = "lyrics_cache.json"       # caches lyrics so we don't re-hit Genius
+CACHE_DB   = "lyrics_cache.db"         # caches lyrics so we don't re-hit Genius
+CACHE_JSON = "lyrics_cache.json"       # legacy cache, imported into CACHE_DB once
 NRC_VAD_PATH = "NRC-VAD-Lexicon.txt"   # optional (if missing, we fall back)
-
-REQUEST_SLEEP = (0.6, 1.2)  # polite randomized pacing between Genius calls
+NRC_VAD_NPY   = "nrc_vad.npy"          # parsed lexicon: (V, 2) valence/arousal table …
+NRC_VAD_WORDS = "nrc_vad_idx.json"     # … and its words in row order; rebuilt when the .txt is newer
+
+GENIUS_RATE = 1.0           # Genius requests per second (60/min), shared by all fetches
+GENIUS_CONCURRENCY = 8      # songs being fetched at once (each may race both providers)
+N_RETRIES = 4               # retries on 429/5xx (exponential, or the server's Retry-After)
+GENIUS_API = "https://api.genius.com"
+EXCLUDED_TERMS = ["(Remix)", "(Live)"]  # skip search hits whose title has these
+MATCH_TOP_N = 5   # search hits considered per song
+MATCH_MIN = 70    # min fuzzy title+artist score (0..100) to accept a hit
+USE_LYRICS_OVH = True       # race lyrics.ovh against Genius (first non-empty lyrics win)
+LYRICS_OVH_API = "https://api.lyrics.ovh/v1"
+LYRICS_OVH_RATE = 5.0       # lyrics.ovh requests per second
 
 # ---------- Optional analyzers ----------
+# Only needed when NRC-VAD has no words for a song, so they are imported (and VADER's
+# lexicon loaded) on the first such song rather than at startup.
+@functools.cache
+def _get_vader():
+    try:
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        return SentimentIntensityAnalyzer()
+    except Exception:
+        return None
+
+@functools.cache
+def _get_textblob():
+    try:
+        from textblob import TextBlob
+        return TextBlob
+    except Exception:
+        return None
+
+# ---------- Lyrics providers (optional) ----------
+# Genius: search via the API, then read the lyrics from the song page's HTML.
+# lyrics.ovh: plain JSON, no key; raced against Genius, first non-empty answer wins.
+load_dotenv()
 try:
-    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-    _VADER = SentimentIntensityAnalyzer()
-    _HAS_VADER = True
+    import aiohttp
+    _HAS_AIOHTTP = True
 except Exception:
-    _VADER = None
-    _HAS_VADER = False
-
+    _HAS_AIOHTTP = False
 try:
-    from textblob import TextBlob
-    _HAS_TB = True
+    from bs4 import BeautifulSoup
+    _HAS_BS4 = True
 except Exception:
-    _HAS_TB = False
+    _HAS_BS4 = False
 
-# ---------- Genius client (optional) ----------
-load_dotenv()
 try:
-    import lyricsgenius
-    _HAS_GENIUS = True
+    from rapidfuzz import fuzz  # hit matching; difflib fallback in _match_score
 except Exception:
-    _HAS_GENIUS = False
+    fuzz = None
 
 GENIUS_API_KEY = os.getenv("GENIUS_API_KEY")
-genius = None
-if _HAS_GENIUS and GENIUS_API_KEY:
-    genius = lyricsgenius.Genius(GENIUS_API_KEY, timeout=15, retries=3)
-    genius.remove_section_headers = True
-    genius.skip_non_songs = True
-    genius.excluded_terms = ["(Remix)", "(Live)"]
-else:
-    print("⚠️ Genius disabled (missing package or API key). Will skip lyrics fetch.", flush=True)
+genius_enabled = bool(_HAS_AIOHTTP and _HAS_BS4 and GENIUS_API_KEY)
+ovh_enabled = bool(_HAS_AIOHTTP and USE_LYRICS_OVH)
+if not genius_enabled:
+    print("⚠️ Genius disabled (missing aiohttp/bs4 or API key).", flush=True)
+if not (genius_enabled or ovh_enabled):
+    print("⚠️ No lyrics provider available. Will skip lyrics fetch.", flush=True)
 
 # ---------- Helpers ----------
 _word_re = re.compile(r"[A-Za-z']+")
+# ASCII-only lyrics (nearly all of them) are lowered with a byte table and tokenized as
+# bytes: no per-codepoint str.lower() and no intermediate str; vad_from_tokens() takes either
+_word_re_bytes = re.compile(rb"[a-z']+")
+_ASCII_LOWER = bytes.maketrans(bytes(range(0x41, 0x5B)), bytes(range(0x61, 0x7B)))
 def log(*a): print(*a, flush=True)
 
 def tokenize(text: str):
-    return _word_re.findall(text.lower()) if isinstance(text, str) else []
+    if not isinstance(text, str):
+        return []
+    if text.isascii():
+        return _word_re_bytes.findall(text.encode("ascii").translate(_ASCII_LOWER))
+    return _word_re.findall(text.lower())
+
+# one pass: banner lines (Embed / You might also like / Contributors), [Chorus]-style
+# section headers and whitespace runs all collapse into a single space
+_CLEAN_RE = re.compile(r"(?mi)(?:^.*(?:embed|you might also like|contributors).*$|\s|\[[^\]\n]*\])+")
 
 def clean_lyrics(txt: str) -> str:
     if not isinstance(txt, str): return ""
-    txt = re.sub(r"(?mi)^.*(embed|you might also like|contributors).*$", "", txt)
-    txt = re.sub(r"\[.*?\]", " ", txt)     # remove [Chorus], [Verse], etc.
-    txt = re.sub(r"\s+", " ", txt).strip()
-    return txt
+    return _CLEAN_RE.sub(" ", txt).strip()
 
 # ---- NRC-VAD loader (valence/arousal on 0..1 scale) ----
-_VAD = {}
+# word -> row in _VAD_ARR (str keys, and UTF-8 bytes keys for bytes tokens);
+# _VAD_ARR[:, 0] is valence, [:, 1] arousal
+_VAD_IDX = {}
+_VAD_IDX_B = {}
+_VAD_ARR = np.empty((0, 2), dtype=np.float64)
+
+def _set_vad(words, arr):
+    global _VAD_IDX, _VAD_IDX_B, _VAD_ARR
+    _VAD_IDX = {w: i for i, w in enumerate(words)}
+    _VAD_IDX_B = {w.encode("utf-8"): i for i, w in enumerate(words)}
+    _VAD_ARR = arr
+
+def _vad_cache_fresh():
+    if not (os.path.exists(NRC_VAD_NPY) and os.path.exists(NRC_VAD_WORDS)):
+        return False
+    if not os.path.exists(NRC_VAD_PATH):
+        return True
+    built = min(os.path.getmtime(NRC_VAD_NPY), os.path.getmtime(NRC_VAD_WORDS))
+    return built >= os.path.getmtime(NRC_VAD_PATH)
+
 def load_vad():
-    global _VAD
+    if _vad_cache_fresh():
+        try:
+            with open(NRC_VAD_WORDS, "rb") as f:
+                words = json_loads(f.read())
+            arr = np.load(NRC_VAD_NPY, mmap_mode="r")  # paged in on demand, shared via the OS cache
+            if arr.shape == (len(words), 2):
+                _set_vad(words, arr)
+                return
+        except Exception:
+            pass  # unreadable cache: reparse the text file below
     if not os.path.exists(NRC_VAD_PATH):
         return
+    vad = {}
     with open(NRC_VAD_PATH, "r", encoding="utf-8") as f:
         for line in f:
             s = line.strip()
@@ -75,35 +142,46 @@ def load_vad():
             try:
                 w = parts[0].lower()
                 v = float(parts[1]); a = float(parts[2])  # already 0..1
-                _VAD[w] = (v, a)
+                vad[w] = (v, a)
             except Exception:
                 continue
+    _set_vad(list(vad), np.array(list(vad.values()), dtype=np.float64).reshape(-1, 2))
+    try:
+        np.save(NRC_VAD_NPY, _VAD_ARR)
+        with open(NRC_VAD_WORDS, "wb") as f:
+            f.write(json_dumps(list(vad)))
+    except Exception:
+        pass  # cache is only a speed-up
 load_vad()
-_HAS_VAD = len(_VAD) > 0
+_HAS_VAD = len(_VAD_IDX) > 0
 
 def vad_from_tokens(tokens):
     if not _HAS_VAD or not tokens:
         return (None, None)
-    vals, aros = [], []
-    for t in tokens:
-        va = _VAD.get(t)
-        if va:
-            vals.append(va[0]); aros.append(va[1])
-    if not vals:
+    lookup = (_VAD_IDX_B if isinstance(tokens[0], bytes) else _VAD_IDX).get
+    idx = np.fromiter((i for i in map(lookup, tokens) if i is not None), dtype=np.intp)
+    if idx.size == 0:
         return (None, None)
-    return (sum(vals)/len(vals), sum(aros)/len(aros))
+    v, a = _VAD_ARR[idx].mean(axis=0)
+    return (float(v), float(a))
 
 def vader_valence_01(text):
-    if not (_HAS_VADER and isinstance(text, str) and text.strip()):
+    if not (isinstance(text, str) and text.strip()):
+        return None
+    vader = _get_vader()
+    if vader is None:
         return None
     try:
-        c = _VADER.polarity_scores(text)["compound"]  # -1..1
+        c = vader.polarity_scores(text)["compound"]  # -1..1
         return (c + 1.0) / 2.0  # → 0..1
     except Exception:
         return None
 
 def textblob_valence_01(text):
-    if not (_HAS_TB and isinstance(text, str) and text.strip()):
+    if not (isinstance(text, str) and text.strip()):
+        return None
+    TextBlob = _get_textblob()
+    if TextBlob is None:
         return None
     try:
         pol = TextBlob(text).sentiment.polarity  # -1..1
@@ -112,43 +190,225 @@ def textblob_valence_01(text):
         return None
 
 # ---------- Cache ----------
-def load_cache():
-    if os.path.exists(CACHE_JSON):
-        try:
-            return json.load(open(CACHE_JSON, "r", encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
+# SQLite key/value table, JSON-encoded values; load_cache() reads it into a dict and
+# cache_put() writes one entry through to both (WAL keeps the per-row commit cheap).
+# With zstandard installed values are stored as zstd BLOBs (lyrics shrink ~4x); plain
+# TEXT rows from older runs still load, and are recompressed when next written.
+try:
+    import zstandard as zstd
+    _ZC, _ZD = zstd.ZstdCompressor(level=3), zstd.ZstdDecompressor()
+except Exception:
+    _ZC = _ZD = None
+
+_db = None
+
+def _pack(value):
+    b = json_dumps(value)
+    return _ZC.compress(b) if _ZC else b.decode("utf-8")  # plain rows stay TEXT
+
+def _unpack(v):
+    """Cached value, or None (a miss) for a zstd row when zstandard isn't installed."""
+    if isinstance(v, bytes):
+        if _ZD is None:
+            return None
+        v = _ZD.decompress(v)
+    return json_loads(v)
+
+def _cache_db():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(CACHE_DB)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("PRAGMA synchronous=NORMAL")
+        _db.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v TEXT)")
+    return _db
+
+def _import_json_cache(db):
+    """One-time migration of the old lyrics_cache.json into SQLite."""
+    if not os.path.exists(CACHE_JSON):
+        return
+    try:
+        with open(CACHE_JSON, "rb") as f:
+            data = json_loads(f.read())
+    except Exception:
+        return
+    db.executemany("INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)",
+                   [(k, _pack(v)) for k, v in data.items()])
+    db.commit()
 
-def save_cache(cache):
-    tmp = CACHE_JSON + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, CACHE_JSON)
+def load_cache():
+    db = _cache_db()
+    if db.execute("SELECT COUNT(*) FROM kv").fetchone()[0] == 0:
+        _import_json_cache(db)
+    rows = ((k, _unpack(v)) for k, v in db.execute("SELECT k, v FROM kv"))
+    return {k: v for k, v in rows if v is not None}
+
+def cache_put(cache, key, value):
+    cache[key] = value
+    db = _cache_db()
+    db.execute("INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)", (key, _pack(value)))
+    db.commit()
 
 def ck(title, artist):
     return f"{title.strip().lower()}|||{artist.strip().lower()}"
 
-def get_lyrics(title: str, artist: str, cache: dict) -> str:
+GENIUS_LIMITER = AsyncRateLimiter(GENIUS_RATE)
+OVH_LIMITER = AsyncRateLimiter(LYRICS_OVH_RATE)
+
+async def paced_get(session, limiter, url, as_json=False, **kwargs):
+    """GET paced by `limiter`; 429/5xx are retried after Retry-After (or an exponential delay)."""
+    delay = 1.0
+    for attempt in range(N_RETRIES + 1):
+        await limiter.wait()
+        async with session.get(url, **kwargs) as r:
+            if (r.status == 429 or r.status >= 500) and attempt < N_RETRIES:
+                retry_after = r.headers.get("Retry-After", "")
+                wait = float(retry_after) if retry_after.isdigit() else delay
+            else:
+                r.raise_for_status()
+                return await (r.json() if as_json else r.text())
+        await asyncio.sleep(wait)
+        delay *= 2
+
+def _match_score(title, artist, hit):
+    """0..100 similarity between the wanted song and a Genius search hit."""
+    want = f"{title} {artist}".lower()
+    got = f"{hit.get('title') or ''} {(hit.get('primary_artist') or {}).get('name') or ''}".lower()
+    if fuzz:
+        return fuzz.token_set_ratio(want, got)
+    return 100 * SequenceMatcher(None, want, got).ratio()
+
+async def resolve_song(session, title, artist):
+    """Best-matching song among the top Genius search hits (excluded terms skipped), or None below MATCH_MIN."""
+    j = await paced_get(session, GENIUS_LIMITER, f"{GENIUS_API}/search", as_json=True,
+                         params={"q": f"{title} {artist}"},
+                         headers={"Authorization": f"Bearer {GENIUS_API_KEY}"})
+    hits = (j or {}).get("response", {}).get("hits", [])
+    candidates = []
+    for h in hits[:MATCH_TOP_N]:
+        res = h.get("result") or {}
+        if h.get("type") != "song" or not res.get("url"):
+            continue
+        if any(t.lower() in (res.get("title") or "").lower() for t in EXCLUDED_TERMS):
+            continue
+        candidates.append(res)
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda res: _match_score(title, artist, res))
+    return best if _match_score(title, artist, best) >= MATCH_MIN else None
+
+async def genius_page_lyrics(session, url):
+    """Raw lyrics text from a Genius song page (the data-lyrics-container divs)."""
+    html = await paced_get(session, GENIUS_LIMITER, url)
+    soup = BeautifulSoup(html, "html.parser")
+    parts = []
+    for div in soup.select('div[data-lyrics-container="true"]'):
+        for br in div.find_all("br"):
+            br.replace_with("\n")
+        parts.append(div.get_text())
+    return "\n".join(parts)
+
+async def fetch_genius(session, title, artist, url=None):
+    """
+    Lyrics from Genius, plus {"song_id", "url"} of the song they came from.
+    A url already resolved on an earlier run skips the search.
+    """
+    meta = {}
+    if not url:
+        hit = await resolve_song(session, title, artist)
+        if not hit:
+            return "", meta
+        url = hit["url"]
+        meta = {"song_id": hit.get("id"), "url": url}
+    return clean_lyrics(await genius_page_lyrics(session, url)), meta
+
+async def fetch_lyrics_ovh(session, title, artist):
+    """Lyrics from lyrics.ovh ("" when it has none; it answers 404 for unknown songs)."""
+    url = f"{LYRICS_OVH_API}/{quote(artist, safe='')}/{quote(title, safe='')}"
+    try:
+        j = await paced_get(session, OVH_LIMITER, url, as_json=True)
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
+            return "", {}
+        raise
+    text = (j or {}).get("lyrics") or ""
+    text = re.sub(r"^Paroles de la chanson .*\n", "", text)  # lyrics.ovh's own header line
+    return clean_lyrics(text), {}
+
+async def first_lyrics(title, artist, tasks):
+    """(text, meta) from whichever provider answers with non-empty lyrics first; the rest are cancelled."""
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is not None:
+                    log(f"⚠️ {t.get_name()} error for {title} – {artist}: {t.exception()}")
+                    continue
+                text, meta = t.result()
+                if text:
+                    return text, meta
+        return "", {}
+    finally:
+        for t in pending:
+            t.cancel()
+
+async def get_lyrics(session, sem, lock, title: str, artist: str, cache: dict) -> str:
     key = ck(title, artist)
     cached = cache.get(key) or {}
     if "lyrics" in cached and cached["lyrics"]:
         return cached["lyrics"]
 
-    text = ""
-    if genius:
-        try:
-            song = genius.search_song(title=title, artist=artist)
-            if song and song.lyrics:
-                text = clean_lyrics(song.lyrics)
-        except Exception as e:
-            log(f"⚠️ Genius error for {title} – {artist}: {e}")
-            text = ""
-
-    cache[key] = {"lyrics": text, **cached}
-    time.sleep(random.uniform(*REQUEST_SLEEP))  # polite
+    text, meta = "", {}
+    tasks = []
+    async with sem:
+        if genius_enabled:
+            tasks.append(asyncio.create_task(fetch_genius(session, title, artist, cached.get("url")), name="Genius"))
+        if ovh_enabled:
+            tasks.append(asyncio.create_task(fetch_lyrics_ovh(session, title, artist), name="lyrics.ovh"))
+        if tasks:
+            text, meta = await first_lyrics(title, artist, tasks)
+
+    async with lock:
+        cache_put(cache, key, {**cached, **meta, "lyrics": text})
     return text
 
+async def fetch_all_lyrics(pairs, cache):
+    """Lyrics for every (title, artist), fetched concurrently (GENIUS_CONCURRENCY at a time), in input order."""
+    sem, lock = asyncio.Semaphore(GENIUS_CONCURRENCY), asyncio.Lock()
+    session = None
+    if genius_enabled or ovh_enabled:
+        # one pooled session for the whole run: TLS and DNS are paid once per host, not per song
+        connector = aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60)
+        session = aiohttp.ClientSession(connector=connector,
+                                        timeout=aiohttp.ClientTimeout(total=15, connect=5))
+    # one fetch per cache key: repeated songs share it instead of racing each other
+    unique = {}
+    for t, a in pairs:
+        unique.setdefault(ck(t, a), (t, a))
+    done = 0
+
+    async def one(title, artist):
+        nonlocal done
+        text = await get_lyrics(session, sem, lock, title, artist, cache)
+        done += 1
+        if done % 25 == 0:
+            log(f"… fetched lyrics {done}/{len(unique)}")
+        return text
+
+    try:
+        results = await asyncio.gather(*[one(t, a) for t, a in unique.values()], return_exceptions=True)
+    finally:
+        if session:
+            await session.close()
+    by_key = {}
+    for k, r in zip(unique, results):
+        if isinstance(r, Exception):
+            log(f"⚠️ Lyrics fetch failed for {k}: {r!r}")  # scored as no lyrics below
+            r = ""
+        by_key[k] = r
+    return [by_key[ck(t, a)] for t, a in pairs]
+
 # ---------- Main ----------
 def _to_float_or_none(x):
     try:
@@ -161,56 +421,64 @@ def main():
     if not os.path.exists(INPUT_CSV):
         raise SystemExit(f"❌ {INPUT_CSV} not found. Run enrich first.")
 
-    df = pd.read_csv(INPUT_CSV)
+    df = read_csv_text(INPUT_CSV)
     for c in ("Title","Artist"):
         if c not in df.columns:
             raise SystemExit("❌ step1_enriched.csv must have Title and Artist")
 
     cache = load_cache()
 
-    lyrics_col = []
-    val_col, aro_col = [], []
+    sent_memo = {}  # lyrics text -> (valence, arousal); covers/duplicates share lyrics
 
     log("🚀 Step 2: fetching lyrics & computing valence/arousal …")
-    for i, row in df.iterrows():
-        title = str(row["Title"])
-        artist = str(row["Artist"])
-        key = ck(title, artist)
-
-        # 1) get lyrics
-        text = get_lyrics(title, artist, cache)
-
-        # 2) compute sentiment — but only trust NUMERIC cached values
-        cached = cache.get(key) or {}
-        v_cached = _to_float_or_none(cached.get("valence"))
-        a_cached = _to_float_or_none(cached.get("arousal"))
-
-        if v_cached is None or a_cached is None:
-            tokens = tokenize(text)
-            v_nrc, a_nrc = vad_from_tokens(tokens)
-            v = v_nrc if v_nrc is not None else vader_valence_01(text) or textblob_valence_01(text)
-            a = a_nrc  # if NRC missing, leave None (that’s okay)
-            # save back to cache as NUMBERS only
-            cache[key] = {"lyrics": text, "valence": _to_float_or_none(v), "arousal": _to_float_or_none(a)}
-        else:
-            v, a = v_cached, a_cached
-            # ensure lyrics also present in cache
-            if "lyrics" not in cached or not cached["lyrics"]:
-                cache[key]["lyrics"] = text
-
-        lyrics_col.append(text)
-        val_col.append(_to_float_or_none(v))
-        aro_col.append(_to_float_or_none(a))
-
-        if (i+1) % 25 == 0:
-            save_cache(cache)
-            log(f"… processed {i+1}/{len(df)}")
-
-    # 3) write out exactly what the rubric expects
-    df["Lyrics"] = lyrics_col
-    df["Lyric sentiment valence"] = pd.to_numeric(val_col, errors="coerce")
-    df["Lyric sentiment arousal"] = pd.to_numeric(aro_col, errors="coerce")
-
-    df.to_csv(OUTPUT_CSV, index=False)
-    save_cache(cache)
+    pairs = list(zip(df["Title"].astype(str), df["Artist"].astype(str)))
+    # 1) get lyrics (network, concurrent)
+    all_lyrics = asyncio.run(fetch_all_lyrics(pairs, cache))
+
+    # rows are written as they're scored (flushed every 25), so nothing is held for a final to_csv
+    out_cols = ["Lyrics", "Lyric sentiment valence", "Lyric sentiment arousal"]
+    fieldnames = [c for c in df.columns if c not in out_cols] + out_cols
+    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=fieldnames)
+        writer.writeheader()
+        rows = df.to_dict("records")
+        for i, (row, (title, artist), text) in enumerate(zip(rows, pairs, all_lyrics)):
+            key = ck(title, artist)
+
+            # 2) compute sentiment — but only trust NUMERIC cached values
+            cached = cache.get(key) or {}
+            v_cached = _to_float_or_none(cached.get("valence"))
+            a_cached = _to_float_or_none(cached.get("arousal"))
+
+            if v_cached is None or a_cached is None:
+                if text in sent_memo:
+                    v, a = sent_memo[text]
+                else:
+                    tokens = tokenize(text)
+                    v_nrc, a_nrc = vad_from_tokens(tokens)
+                    v = v_nrc if v_nrc is not None else vader_valence_01(text) or textblob_valence_01(text)
+                    a = a_nrc  # if NRC missing, leave None (that’s okay)
+                    sent_memo[text] = (v, a)
+                # save back to cache as NUMBERS only
+                cache_put(cache, key, {**cached, "lyrics": text,
+                                       "valence": _to_float_or_none(v), "arousal": _to_float_or_none(a)})
+            else:
+                v, a = v_cached, a_cached
+                # ensure lyrics also present in cache
+                if "lyrics" not in cached or not cached["lyrics"]:
+                    cache_put(cache, key, {**cached, "lyrics": text})
+
+            # 3) write out exactly what the rubric expects
+            row.update({"Lyrics": text,
+                        "Lyric sentiment valence": _to_float_or_none(v),
+                        "Lyric sentiment arousal": _to_float_or_none(a)})
+            writer.writerow({k: csv_value(row.get(k)) for k in fieldnames})
+
+            if (i+1) % 25 == 0:
+                fh.flush()
+                log(f"… processed {i+1}/{len(df)}")
+
     log(f"✅ Step 2 done → {OUTPUT_CSV}")
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,12 @@
 # - Backoff/retries for rate limits
 # - Safety: non-clinical, research framing
 
-import os, json, time, math
+import os, csv, math, asyncio, sqlite3
 import pandas as pd
 from pathlib import Path
 from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict
+from pipeline_utils import AsyncRateLimiter, csv_value, json_dumps, json_loads, read_csv_text
 
 # -------------------- Setup --------------------
 load_dotenv()
@@ -18,16 +20,22 @@ if not OPENAI_API_KEY:
     raise RuntimeError("Missing OPENAI_API_KEY in .env")
 
 # pip install openai==1.*  (the new SDK)
-from openai import OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+from openai import AsyncOpenAI
+client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 INPUT_CSV  = "step2_lyrics_output.csv"   # must include Title, Artist, BPM, Mode, Lyric sentiment valence, Lyric sentiment arousal (names can be tweaked below)
 OUTPUT_CSV = "step3_full_dataset.csv"
-CACHE_JSON = Path("step3_gpt_cache.json")
+CACHE_DB   = Path("step3_gpt_cache.db")
+CACHE_JSON = Path("step3_gpt_cache.json")  # legacy cache, imported into CACHE_DB once
 
 MODEL = "gpt-4o-mini"  # change if you prefer another model
 N_RETRIES = 4
 BASE_SLEEP = 1.0
+MAX_RPM = 300  # client-side cap on OpenAI requests per minute
+CONCURRENCY = 8  # OpenAI requests in flight at once
+# Batch API: half the token price, but results can take up to 24 h; off for interactive runs
+USE_BATCH_API = False
+BATCH_POLL_SECONDS = 30
 
 # -------------------- Column mapping --------------------
 # If your CSV has slightly different headers, adjust here:
@@ -71,6 +79,17 @@ USER_TMPL = (
     "- Output strict JSON only."
 )
 
+class Fill(BaseModel):
+    """The model's answer; enforced server-side as a strict JSON schema (Structured Outputs)."""
+    model_config = ConfigDict(extra="forbid")
+    listening_context: str
+    contraindications: str
+    rationale: str
+
+# same schema for Batch API lines, which can't pass the pydantic class itself
+FILL_FORMAT = {"type": "json_schema",
+               "json_schema": {"name": "fill", "strict": True, "schema": Fill.model_json_schema()}}
+
 def sanitize_float(x):
     if x is None or (isinstance(x, float) and (math.isnan(x) or math.isinf(x))):
         return None
@@ -79,33 +98,74 @@ def sanitize_float(x):
     except Exception:
         return None
 
+# SQLite key/value cache (JSON values), read into a dict once and written through per entry
+_db = None
+
+def _cache_db():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(CACHE_DB)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("PRAGMA synchronous=NORMAL")
+        _db.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v TEXT)")
+    return _db
+
+def _import_json_cache(db):
+    """One-time migration of the old step3_gpt_cache.json into SQLite."""
+    if not CACHE_JSON.exists():
+        return
+    try:
+        data = json_loads(CACHE_JSON.read_bytes())
+    except Exception:
+        return
+    db.executemany("INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)",
+                   [(k, json_dumps(v).decode("utf-8")) for k, v in data.items()])
+    db.commit()
+
 def load_cache():
-    if CACHE_JSON.exists():
-        try:
-            return json.loads(CACHE_JSON.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
+    db = _cache_db()
+    if db.execute("SELECT COUNT(*) FROM kv").fetchone()[0] == 0:
+        _import_json_cache(db)
+    return {k: json_loads(v) for k, v in db.execute("SELECT k, v FROM kv")}
+
+def cache_put(cache, key, value):
+    cache[key] = value
+    db = _cache_db()
+    db.execute("INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)", (key, json_dumps(value).decode("utf-8")))
+    db.commit()
 
-def save_cache(cache):
-    CACHE_JSON.write_text(json.dumps(cache, ensure_ascii=False, indent=2), encoding="utf-8")
+_limiter = AsyncRateLimiter(MAX_RPM / 60)
+
+def retry_after_seconds(e):
+    """Retry-After from an OpenAI API error's response, if it sent one."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
 
-def call_model(payload):
+def model_request(payload):
+    """Chat-completion arguments for one song (shared by live calls and Batch API lines)."""
+    return dict(
+        model=MODEL,
+        temperature=0,
+        messages=[
+            {"role":"system","content": SYSTEM},
+            {"role":"user","content": payload}
+        ],
+    )
+
+def cache_entry(ans: Fill):
+    return ans.model_dump()
+
+async def call_model(payload):
     # Backoff + retries for rate limits/network blips
     sleep = BASE_SLEEP
     for attempt in range(N_RETRIES):
+        await _limiter.wait()
         try:
-            r = client.chat.completions.create(
-                model=MODEL,
-                temperature=0,
-                response_format={"type": "json_object"},
-                messages=[
-                    {"role":"system","content": SYSTEM},
-                    {"role":"user","content": payload}
-                ],
-            )
-            content = r.choices[0].message.content
-            return json.loads(content)
+            r = await client.beta.chat.completions.parse(**model_request(payload), response_format=Fill)
+            return r.choices[0].message.parsed  # None if the model refused
         except Exception as e:
             msg = str(e)
             # Basic rate-limit/backoff handling
@@ -115,20 +175,79 @@ def call_model(payload):
                     raise RuntimeError(
                         "OpenAI quota exhausted. Add billing or reduce usage."
                     )
-                time.sleep(sleep)
+                await asyncio.sleep(retry_after_seconds(e) or sleep)  # the API says how long to wait
                 sleep *= 2
                 continue
             # transient network/server error
             if attempt < N_RETRIES - 1:
-                time.sleep(sleep)
+                await asyncio.sleep(sleep)
                 sleep *= 2
                 continue
             raise
     return None
 
+async def fill_one(sem, lock, key, user_msg, cache):
+    """One model call under the concurrency cap; the cleaned answer is cached before returning."""
+    async with sem:
+        ans = await call_model(user_msg)
+    if ans is None:
+        return None
+    entry = cache_entry(ans)
+    async with lock:
+        cache_put(cache, key, entry)
+    return entry
+
+async def fill_all(pending, cache):
+    """Run every uncached prompt concurrently; returns {key: answer or exception}."""
+    sem, lock = asyncio.Semaphore(CONCURRENCY), asyncio.Lock()
+    keys = list(pending)
+    results = await asyncio.gather(*[fill_one(sem, lock, k, pending[k], cache) for k in keys],
+                                   return_exceptions=True)  # one failed row doesn't sink the batch
+    return dict(zip(keys, results))
+
+async def fill_all_batch(pending, cache):
+    """
+    Submit every uncached prompt as one Batch API job (custom_id = cache key), wait for it,
+    and cache the answers. Anything the batch doesn't answer goes through fill_all().
+    """
+    lines = [json_dumps({"custom_id": key, "method": "POST", "url": "/v1/chat/completions",
+                         "body": {**model_request(msg), "response_format": FILL_FORMAT}})
+             for key, msg in pending.items()]
+    results = {}
+    try:
+        f = await client.files.create(file=("step3_batch.jsonl", b"\n".join(lines)),
+                                      purpose="batch")
+        batch = await client.batches.create(input_file_id=f.id, endpoint="/v1/chat/completions",
+                                            completion_window="24h")
+        print(f"📦 Submitted batch {batch.id} with {len(lines)} requests; polling every {BATCH_POLL_SECONDS}s …")
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(BATCH_POLL_SECONDS)
+            batch = await client.batches.retrieve(batch.id)
+        if batch.output_file_id:
+            out = await client.files.content(batch.output_file_id)
+            for line in out.text.splitlines():
+                item = json_loads(line)
+                resp = item.get("response") or {}
+                if resp.get("status_code") != 200:
+                    continue
+                try:
+                    ans = Fill.model_validate_json(resp["body"]["choices"][0]["message"]["content"])
+                except Exception:
+                    continue
+                entry = cache_entry(ans)
+                cache_put(cache, item["custom_id"], entry)
+                results[item["custom_id"]] = entry
+        print(f"📦 Batch {batch.id} {batch.status}: {len(results)}/{len(lines)} answered")
+    except Exception as e:
+        print(f"⚠️ Batch API failed ({e}); falling back to live calls")
+    rest = {k: v for k, v in pending.items() if k not in results}
+    if rest:
+        results.update(await fill_all(rest, cache))
+    return results
+
 def main():
     # Load data
-    df = pd.read_csv(INPUT_CSV)
+    df = read_csv_text(INPUT_CSV)
     # Normalize NaNs to None
     df = df.where(pd.notna(df), None)
 
@@ -138,10 +257,18 @@ def main():
     if COL_OUT_CON not in df.columns:
         df[COL_OUT_CON] = None
 
+    # Skip rows already filled (idempotent): only rows missing either output are visited
+    def filled(col):
+        return df[col].notna() & df[col].astype(str).ne("")
+    todo = df.loc[~(filled(COL_OUT_CTX) & filled(COL_OUT_CON))]
+
     cache = load_cache()
     updates = 0
 
-    for idx, row in df.iterrows():
+    # rows to fill -> cache key; one prompt per key not yet cached
+    targets, pending = {}, {}
+    # plain dict rows: .get() on optional columns works the same, without a Series per row
+    for idx, row in zip(todo.index, todo.to_dict("records")):
         title  = (row.get(COL_TITLE)  or "").strip()
         artist = (row.get(COL_ARTIST) or "").strip()
 
@@ -149,8 +276,8 @@ def main():
         if not title or not artist:
             continue  # skip incomplete rows
 
-        # Skip if already filled (idempotent)
-        if row.get(COL_OUT_CTX) and row.get(COL_OUT_CON):
+        targets[idx] = key
+        if key in cache or key in pending:
             continue
 
         # Build the user payload
@@ -160,7 +287,7 @@ def main():
         lval = sanitize_float(row.get(COL_L_VAL))
         laro = sanitize_float(row.get(COL_L_ARO))
 
-        user_msg = USER_TMPL.format(
+        pending[key] = USER_TMPL.format(
             title=title, artist=artist,
             bpm=bpm if bpm is not None else "NA",
             mode=mode if mode else "NA",
@@ -169,31 +296,32 @@ def main():
             laro=f"{laro:.2f}" if laro is not None else "NA",
         )
 
-        # Cache hit?
-        if key in cache:
-            ans = cache[key]
-        else:
-            ans = call_model(user_msg)
-            if ans is None:
-                continue
-            # keep cache small/clean
-            cache[key] = {
-                "listening_context": ans.get("listening_context"),
-                "contraindications": ans.get("contraindications"),
-                "rationale": ans.get("rationale"),
-            }
-            if (idx + 1) % 10 == 0:
-                save_cache(cache)
-
-        # Write back to dataframe
-        df.at[idx, COL_OUT_CTX] = ans.get("listening_context")
-        df.at[idx, COL_OUT_CON] = ans.get("contraindications")
-        updates += 1
-
-    # Save outputs
-    df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8")
-    save_cache(cache)
+    fill = fill_all_batch if USE_BATCH_API else fill_all
+    results = asyncio.run(fill(pending, cache)) if pending else {}
+    quota_hit = False
+    for key, res in results.items():
+        if isinstance(res, Exception):
+            quota_hit = quota_hit or "quota exhausted" in str(res)
+            print(f"⚠️ GPT fill failed for {key}: {res}")
+
+    # Stream rows out in input order, filling targets from the cache (hits and fresh answers alike)
+    fieldnames = list(df.columns)
+    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=fieldnames)
+        writer.writeheader()
+        for i, (idx, row) in enumerate(zip(df.index, df.to_dict("records")), 1):
+            ans = cache.get(targets.get(idx))
+            if ans:
+                row[COL_OUT_CTX] = ans.get("listening_context")
+                row[COL_OUT_CON] = ans.get("contraindications")
+                updates += 1
+            writer.writerow({k: csv_value(v) for k, v in row.items()})
+            if i % 25 == 0:
+                fh.flush()
+
     print(f"✅ Step 3 done → {OUTPUT_CSV} (updated {updates} rows)")
+    if quota_hit:
+        raise SystemExit("❌ OpenAI quota exhausted. Add billing or reduce usage.")
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,18 @@
-import pandas as pd
+import importlib.util
 from datetime import date
+from pipeline_utils import read_csv_text
+
+# Arrow-backed strings run .str.strip()/.lower() in Arrow's C++ kernels instead of per-cell Python
+STR_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else "string"
 
 # Load original and final outputs
-orig = pd.read_csv("songs.csv")  # must have Title, Artist
-final = pd.read_csv("step2_lyrics_output.csv")
+orig = read_csv_text("songs.csv")  # must have Title, Artist
+final = read_csv_text("step2_lyrics_output.csv")
 
 # Normalize for safer matching
 for df in (orig, final):
-    df["Title_norm"] = df["Title"].str.strip().str.lower()
-    df["Artist_norm"] = df["Artist"].str.strip().str.lower()
+    df["Title_norm"] = df["Title"].astype(STR_DTYPE).str.strip().str.lower()
+    df["Artist_norm"] = df["Artist"].astype(STR_DTYPE).str.strip().str.lower()
 
 # Preserve original order
 orig["_row"] = range(len(orig))